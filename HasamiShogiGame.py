@@ -1,22 +1,43 @@
 # Name: Alex Henner
 # Date: 11/12/21
 # Description: This program implements the Hasmi Shogi Game Variant 1.
-import json
-from typing import List, Dict, Callable, Union, Tuple, Any, Set
-import sys, time, random, pygame as pg
-from pygame import Surface
+import math
+import mmap
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import List, Dict, Union, Tuple, Any, Set, TYPE_CHECKING
+import os, sys, time, random, threading
+try:
+    import numpy as np
+except ImportError:                                 # numpy is only needed for batched evaluation
+    np = None
+if TYPE_CHECKING:                                   # pygame is only imported once something is drawn
+    from pygame import Surface
 
 WIDTH, HEIGHT = 750, 820
 GAP = (WIDTH - 40) // 9
-WOOD_TILE = pg.transform.scale(pg.image.load('Images/wood_tile.png'), (GAP, GAP))
-BLACK_PIECE = pg.transform.scale(pg.image.load('Images/Shogi_black.png'), (GAP - 10, GAP - 10))
-RED_PIECE = pg.transform.scale(pg.image.load('Images/Shogi_red.png'), (GAP - 10, GAP - 10))
+_images: Dict[str, "Surface"] = {}                  # loaded by load_images the first time they are drawn
+
+
+def load_images() -> Dict[str, "Surface"]:
+    """Loads and scales the tile and piece images the first time they are needed"""
+    if not _images:
+        import pygame as pg
+        _images['WOOD_TILE'] = pg.transform.scale(pg.image.load('Images/wood_tile.png'), (GAP, GAP))
+        _images['BLACK_PIECE'] = pg.transform.scale(pg.image.load('Images/Shogi_black.png'), (GAP - 10, GAP - 10))
+        _images['RED_PIECE'] = pg.transform.scale(pg.image.load('Images/Shogi_red.png'), (GAP - 10, GAP - 10))
+    return _images
 
 
 class HasamiShogiGame:
     """Hasami Shogi Game Variant 1 implementation has a Board object, which has Square objects"""
-    def __init__(self, win: Union["Surface", "SurfaceType"]):
-        """Initializes game state, active player, list of ranks, and initializes the board object"""
+    def __init__(self, win: Union["Surface", "SurfaceType", None] = None):
+        """
+        Initializes game state, active player, list of ranks, and initializes the board object.
+        Without a window the game runs headless, like the AI games in terminal()
+        """
         self._game_states: List[str] = ["UNFINISHED", "RED_WON", "BLACK_WON"]
         self._game_state: str = self._game_states[0]
 
@@ -54,7 +75,7 @@ class HasamiShogiGame:
 
     def get_num_captured_pieces(self, player: str) -> int:
         """Counts the captured pieces of the given player"""
-        return 9 - self._board.count_pieces()[player]
+        return 9 - self._board.count(player)
 
     def make_move(self, from_location: str, to_location: str) -> bool:
         """
@@ -152,26 +173,42 @@ class HasamiShogiGame:
 
 
 class Board:
-    """Creates a board object that is 9x9 Square objects"""
+    """
+    Creates a board object that is 9x9 Square objects. The pieces are kept in a Position, which has the rules for
+    moves, captures and winning, and the Squares are views of it that hold what is needed to draw them.
+    The selected and possible flags of every square are kept in a bytearray indexed by square (rank * 9 + file)
+    and the squares of each side's pieces in a set, so counting and finding pieces doesn't scan the board
+    """
+    SELECTED = 1
+    POSSIBLE = 2
+
     def __init__(self,
-                 win: Union["Surface", "SurfaceType"],
+                 win: Union["Surface", "SurfaceType", None],
                  board: str = 'RRRRRRRRR/9/9/9/9/9/9/9/BBBBBBBBB'):
-        """initializes the board as nested lists and calls method to create the board"""
-        self._board: List[List[Square]] = []
+        """initializes the board as a flat list of squares and calls method to create the board"""
+        self._board: List[Square] = []
+        self._flags = bytearray(81)
+        self._locations: List[Set[int]] = [set(), set()]    # squares of the BLACK and RED pieces
         self._rows = 9
         self._cols = 9
         self._buffer = 20
-        self._top_gap = win.get_height() - win.get_width() + self._buffer       # Helping to make a square after gap
-        self._width = win.get_width() - self._buffer
-        self._height = win.get_height() - self._top_gap
+        width, height = (win.get_width(), win.get_height()) if win is not None else (WIDTH, HEIGHT)
+        self._top_gap = height - width + self._buffer       # Helping to make a square after gap
+        self._width = width - self._buffer
+        self._height = height - self._top_gap
         self._gap = (self._width - 2 * self._buffer) // self._cols
+        self._position = Position()
         self.create_board()
         self.set_board(board)
 
-    def get_board(self):
-        """returns board"""
+    def get_board(self) -> List['Square']:
+        """returns the 81 squares of the board, going left to right and top to bottom"""
         return self._board
 
+    def get_position(self) -> 'Position':
+        """returns the position that has the pieces of the board"""
+        return self._position
+
     def get_buffer(self):
         """returns buffer"""
         return self._buffer
@@ -204,66 +241,42 @@ class Board:
 
     def refresh_possible(self):
         """changes all is possible values back to false"""
-        for rank in self._board:
-            for square in rank:
-                square.set_is_possible(False)
+        self._flags = self._flags.translate(POSSIBLE_CLEARED)
 
-    def get_player_locations(self, player: str) -> List['Square']:
-        """Gets red locations for the AI"""
-        pieces = []
-        for row in self._board:
-            for el in row:
-                if el.get_piece() == player:
-                    pieces.append(el)
-        return pieces
+    def get_flag(self, square: int, flag: int) -> bool:
+        """returns if flag (SELECTED or POSSIBLE) is set on square"""
+        return bool(self._flags[square] & flag)
 
-    def create_board(self) -> None:
-        """Creates the board by creating 9x9 Square objects and connects them all. It also places the initial pieces"""
-
-        # iterate over all Squares and connect them to top and left squares and assign starting position values
-        for rank in range(1, 10):
-            self._board.append([])
-            for file in range(1, 10):
-                if rank == 1:               # a
-                    top = None
-                else:
-                    top = self._board[rank-2][file-1]
-
-                if file == 1:               # left
-                    left = None
-                else:
-                    left = self._board[rank-1][file-2]
-
-                self._board[rank-1].append(Square("NONE", top, left, rank, file, self._gap, self._top_gap, self._buffer))
+    def set_flag(self, square: int, flag: int, value: bool) -> None:
+        """sets or clears flag (SELECTED or POSSIBLE) on square"""
+        if value:
+            self._flags[square] |= flag
+        else:
+            self._flags[square] &= ~flag
 
-        # reiterate over the squares and connect them to the bottom and right squares
-        for rank in range(9):
-            for file in range(9):
-                if rank == 8:
-                    bottom = None
-                else:
-                    bottom = self._board[rank+1][file]
+    def get_player_locations(self, player: str) -> List['Square']:
+        """Gets the squares that have the pieces of player for the AI"""
+        return [self._board[square] for square in sorted(self._locations[PLAYERS.index(player)])]
 
-                if file == 8:
-                    right = None
-                else:
-                    right = self._board[rank][file+1]
-                self._board[rank][file].set_bottom_and_right(bottom, right)
+    def create_board(self) -> None:
+        """Creates the board by creating the 81 Square objects, neighbors are found with the NEIGHBORS table"""
+        self._board = [Square(self, square) for square in range(81)]
 
     def set_board(self, board: str) -> None:
         """sets pieces onto board using FEN"""
-        rows = board.split('/')
-        for rank in range(len(self._board)):
-            file = 0
-            for char in rows[rank]:
-                if char == 'R':
-                    self._board[rank][file].set_piece("RED")
-                    file += 1
-                elif char == 'B':
-                    self._board[rank][file].set_piece("BLACK")
-                    file += 1
-                else:
-                    file += int(char)
+        self._position = Position.from_fen(board)
+        for side in (0, 1):
+            bits = self._position.get_pieces(side)
+            self._locations[side] = {square for square in range(81) if bits >> square & 1}
+
+    def set_piece(self, square: int, side: Union[int, None]) -> None:
+        """Puts a piece of side on square, or empties it when side is None"""
+        current = self._position.occupant(square)
+        if current is not None:
+            self._locations[current].discard(square)
+        if side is not None:
+            self._locations[side].add(square)
+        self._position.set_piece(square, side)
 
     def print_board(self) -> None:
         """Pretty prints the board with tiles for NONE Squares and row and column indices"""
@@ -274,7 +287,7 @@ class Board:
         letters = "abcdefghi"
         for rank in range(9):
             for file in range(9):
-                piece = self._board[rank][file].get_piece()
+                piece = self.occupant(rank, file).get_piece()
                 if piece == "NONE":
                     piece = "|_____|"
                 else:
@@ -284,200 +297,116 @@ class Board:
             print(letters[rank])
 
     def count_pieces(self) -> Dict[str, int]:
-        """Goes through all of the Square Objects on the board and counts how many pieces the player has left"""
-        pieces: Dict[str, int] = {'BLACK': 0, 'RED': 0}
+        """Returns how many pieces each player has left"""
+        return {'BLACK': len(self._locations[0]), 'RED': len(self._locations[1])}
 
-        for rank in range(9):
-            for file in range(9):
-                curr_piece = self._board[rank][file].get_piece()
-                pieces[curr_piece] = pieces.get(curr_piece, 0) + 1
-
-        pieces.pop("NONE")
-        return pieces
+    def count(self, player: str) -> int:
+        """Returns how many pieces player has left"""
+        return len(self._locations[PLAYERS.index(player)])
 
     def won(self) -> bool:
         """checks if there is a winner"""
-        pieces = self.count_pieces()
-        if len(pieces) <= 1:
-            return True
-        if pieces['BLACK'] == 1 or pieces['RED'] == 1:
-            return True
-
-        return False
+        return len(self._locations[0]) <= 1 or len(self._locations[1]) <= 1
 
     def evaluate(self, player: str, board: 'Board') -> int:
         """Evaluates the state of the current board"""
+        return self.evaluate_position(self._position, player, board.get_position())
 
+    @staticmethod
+    def evaluate_position(position: 'Position', player: str, previous_position: 'Position') -> int:
+        """Evaluates position for player, pieces captured since previous_position are worth 5 each"""
         pieces_score = 0
-        opponent_locations = []
-        pieces = self.count_pieces()
-        # print(f'pieces: {pieces}')
-        previous_pieces = board.count_pieces()
-        if len(pieces) == 1:
-            if player in pieces:
-                return 100
-            else:
-                return -100
-        for key in pieces:
-            if key == player:
-                if pieces[key] == 1:
+        side = PLAYERS.index(player)
+        for key in (0, 1):
+            pieces = position.count(key)
+            if key == side:
+                if pieces <= 1:
                     return -100
-                pieces_score -= (previous_pieces[key] - pieces[key]) * 5
+                pieces_score -= (previous_position.count(key) - pieces) * 5
             else:
-                if pieces[key] == 1:
+                if pieces <= 1:
                     return 100
-                pieces_score += (previous_pieces[key] - pieces[key]) * 5
-                opponent_locations = self.get_player_locations(key)
-                opponent_pieces = pieces[key]
-        locations = self.get_player_locations(player)
+                pieces_score += (previous_position.count(key) - pieces) * 5
+                opponent_pieces = pieces
+        # look up the left open pieces of every rank and file in the line tables
+        player_table = LEFT_OPEN_TABLE[side]
+        opponent_table = LEFT_OPEN_TABLE[1 - side]
         open_score = 0
-        for location in locations:
-            open_score -= self._left_open_pieces(location, Square.get_left, Square.get_right)
-            open_score -= self._left_open_pieces(location, Square.get_top, Square.get_bottom)
-
-        for location in opponent_locations:
-            open_score += self._left_open_pieces(location, Square.get_left, Square.get_right)
-            open_score += self._left_open_pieces(location, Square.get_top, Square.get_bottom)
+        for line in position.get_lines():
+            open_score += opponent_table[line] - player_table[line]
 
         return (open_score // (opponent_pieces+1)) + pieces_score + random.randint(-4, 4)
 
     def occupant(self, rank: int, file: int) -> 'Square':
         """returns the Square Object that is on the rank and file location"""
-        return self._board[rank][file]
+        return self._board[rank * 9 + file]
 
-    def possible_moves(self, location):
-        """Checks what the possible moves are of the the current selection"""
-        curr_square = self.occupant(*self.convert_location(location))
-        directions: List[Callable] = [Square.get_right, Square.get_bottom, Square.get_left, Square.get_top]
+    def square(self, square: int) -> 'Square':
+        """returns the Square Object of a Position square (rank * 9 + file)"""
+        return self._board[square]
 
-        # Crawl in all 4 directions
-        for func in directions:
-            self._possible_move_helper(curr_square, func)
+    def _targets(self, square: int) -> int:
+        """returns the bitboard of the squares the piece on square can move to"""
+        position = self._position
+        return Position.destinations(square, position.get_pieces(0) | position.get_pieces(1))
 
-    @staticmethod
-    def _possible_move_helper(piece: 'Square', direction: Callable):
-        """Sets all possible squares to True"""
-        while direction(piece):
-            piece = direction(piece)
-            if piece.get_piece() != "NONE":         # if there is a piece in the way it can't be possible
-                return
-            else:
-                piece.set_is_possible(True)
+    def possible_moves(self, location):
+        """Checks what the possible moves are of the the current selection"""
+        rank, file = self.convert_location(location)
+        targets = self._targets(rank * 9 + file)
+        while targets:
+            target = targets & -targets
+            self.square(target.bit_length() - 1).set_is_possible(True)
+            targets ^= target
 
     def capture_pieces(self, piece: 'Square') -> None:
         """
-        Goes in all 4 directions of the moved piece to check for capture, corners, and if moved piece captures self
+        Removes the pieces sandwiched in all 4 directions by the moved piece, then the corner pieces surrounded by
+        opponent pieces, including the moved piece capturing itself
         """
-
-        directions: List[Callable] = [Square.get_right, Square.get_bottom, Square.get_left, Square.get_top]
-        corners: List['Square'] = [
-            self.occupant(0, 0),
-            self.occupant(0, 8),
-            self.occupant(8, 8),
-            self.occupant(8, 0)]
-
-        # Check all 4 directions for capture
-        for func in directions:
-            self._capture_piece_direction(piece, func)
-
-        # Check corners for captures
-        direction_1 = 0
-        direction_2 = 1
-        for corner in corners:
-            self._capture_piece_corner(corner, directions[direction_1 % 4], directions[direction_2 % 4])
-            direction_1 += 1
-            direction_2 += 1
-
-    @staticmethod
-    def _capture_piece_corner(piece: 'Square', direction_1: Callable, direction_2: Callable) -> None:
-        """Helper function to check if corner piece should be captured and update to captured"""
-        # If there isn't a piece in the corner or pieces surrounding it
-        if piece.get_piece() == "NONE" or direction_1(piece).get_piece() == "NONE" \
-                or direction_2(piece).get_piece() == "NONE":
+        side = self._position.occupant(piece.get_square())
+        if side is None:
             return
-
-        # Check to see if the surrounding pieces are opponent pieces
-        if direction_1(piece).get_piece() != piece.get_piece() and direction_2(piece).get_piece() != piece.get_piece():
-            piece.set_piece("NONE")
+        captured = self._position.remove_captures(side, piece.get_square())
+        for captured_side in (0, 1):
+            bits = captured[captured_side]
+            while bits:
+                bit = bits & -bits
+                self._locations[captured_side].discard(bit.bit_length() - 1)
+                bits ^= bit
 
     @staticmethod
-    def _left_open_pieces(piece: 'Square', direction_1: Callable, direction_2: Callable) -> int:
-        """TODO"""
-        flag = False
-        captured_pieces: List['Square'] = []
-        curr_piece = piece.get_piece()
-        if curr_piece == 'NONE':
-            return 0
-        center = piece
-        while piece and piece.get_piece() == curr_piece:
-            captured_pieces.append(piece)
-            piece = direction_1(piece)
-
-        if not piece:
-            return 0
-        elif piece.get_piece() == "NONE":
-            flag = True
-
-        piece = direction_2(center)
-        while piece and piece.get_piece() == curr_piece:
-            captured_pieces.append(piece)
-            piece = direction_2(piece)
-
-        if not piece:
-            return 0
-        elif piece.get_piece() == "NONE" and flag:
-            return len(captured_pieces) // 2
-
-        return len(captured_pieces)
-
-    def _capture_piece_direction(self, piece: 'Square', direction: Callable) -> None:
-        """Checks if there should be captured pieces in the direction given and calls function to capture them"""
-        captured_pieces: List['Square'] = []
-        curr_piece = piece.get_piece()
-        while direction(piece):
-            piece = direction(piece)
-            if piece.get_piece() == "NONE":                 # if we find empty square then no capture possible
-                return
-
-            if piece.get_piece() != curr_piece:             # if opposite color as initial add to capture
-                captured_pieces.append(piece)
-            else:                                           # if same color as initial moved piece capture if any
-                self._update_pieces(captured_pieces)
-                return
-
-    @staticmethod
-    def _update_pieces(captured_pieces: List['Square']):
-        """Updates captured pieces to NONE"""
-        for piece in captured_pieces:
-            piece.set_piece("NONE")
+    def _left_open_pieces(line: List[int], piece: int) -> int:
+        """
+        Scores the runs of piece in a rank or file (0 empty, 1 BLACK, 2 RED). A run that reaches the edge scores 0,
+        one with empty squares on both ends scores half its length and one that touches an opponent its length
+        """
+        score = 0
+        for index in range(9):
+            if line[index] != piece:
+                continue
+            start = end = index
+            while start > 0 and line[start - 1] == piece:
+                start -= 1
+            while end < 8 and line[end + 1] == piece:
+                end += 1
+            if start == 0 or end == 8:
+                continue
+            if line[start - 1] == 0 and line[end + 1] == 0:
+                score += (end - start + 1) // 2
+            else:
+                score += end - start + 1
+        return score
 
     def move(self, from_rank: int, from_file: int, to_rank: int, to_file: int) -> bool:
         """
-        Determines the direction the piece is trying to move and the distance it wants to travel.
-        It calls a function to check if it is possible and if it is it will move the piece to the desired location.
-        """
-
-        # Assigns direction to the function of movement for a Square Object and distance to travel
-        if from_file == to_file and from_rank < to_rank:            # Vertical Down
-            direction = Square.get_bottom
-            distance = abs(from_rank - to_rank)
-        elif from_file == to_file and from_rank > to_rank:          # Vertical Up
-            direction = Square.get_top
-            distance = abs(from_rank - to_rank)
-        elif from_rank == to_rank and from_file > to_file:          # Horizontal Left
-            direction = Square.get_left
-            distance = abs(from_file - to_file)
-        elif from_rank == to_rank and from_file < to_file:          # Horizontal Right
-            direction = Square.get_right
-            distance = abs(from_file - to_file)
-        else:
-            return False
-
-        # If piece can move, then move it
-        if self._possible_move(self._board[from_rank][from_file], direction, distance):
-            piece = self._board[from_rank][from_file].get_piece()   # Grab current piece
-            self._board[to_rank][to_file].set_piece(piece)          # Change to location to piece
-            self._board[from_rank][from_file].set_piece("NONE")     # Remove piece from location
+        Checks with the position that the piece can slide from the from location to the to location
+        without going through another piece, and if it can it will move the piece to the desired location.
+        """
+        from_square, to_square = from_rank * 9 + from_file, to_rank * 9 + to_file
+        if self._position.is_legal((from_square, to_square)):
+            self.set_piece(to_square, self._position.occupant(from_square))
+            self.set_piece(from_square, None)
             return True
 
         return False
@@ -489,65 +418,27 @@ class Board:
         to_location.set_piece(from_location.get_piece())
         from_location.set_piece("NONE")
 
-    @staticmethod
-    def _possible_move(square: 'Square', direction: Callable, distance: int) -> bool:
-        """Checks to make sure there are no pieces in the direction the piece would like to move"""
-        for _ in range(distance):
-            square = direction(square)
-            if square.get_piece() != "NONE":
-                return False
-
-        return True
-
-    def ai_possible_moves(self, location) -> List[Any]:
-        """Checks what the possible moves are of the the current selection"""
-        directions: List[Callable] = [Square.get_right, Square.get_bottom, Square.get_left, Square.get_top]
+    def ai_possible_moves(self, location: 'Square') -> List[Any]:
+        """Finds the squares the piece on location can move to, going right, bottom, left and top"""
+        square = location.get_square()
+        targets = self._targets(square)
         possible_moves = []
-        for func in directions:
-            curr_moves = self._ai_possible_move_helper(location, func)
-            # check to see if possible moves were found in that direction
-            if curr_moves:
-                possible_moves.extend(curr_moves)
+        for direction in range(4):
+            ray = RAYS[direction][square] & targets
+            while ray:
+                # nearest first, which is the lowest bit going right and bottom and the highest going left and top
+                bit = ray & -ray if direction < 2 else 1 << (ray.bit_length() - 1)
+                possible_moves.append(self.square(bit.bit_length() - 1))
+                ray ^= bit
         return [location, possible_moves]
 
-    @staticmethod
-    def _ai_possible_move_helper(piece: 'Square', direction: Callable) -> List['Square']:
-        """Sets all possible squares to True"""
-        possibles = []
-        while direction(piece):
-            piece = direction(piece)
-            # if we find a piece in the way go and return what we have found if any
-            if piece.get_piece() != "NONE":
-                return possibles
-            else:
-                possibles.append(piece)
-        return possibles
-
     def generate_fen(self) -> str:
         """generates FEN representation of the board"""
-        fen = ""
-        for rank in range(len(self._board)):
-            count = 0
-            for file in range(len(self._board[rank])):
-                if self._board[rank][file].get_piece() == "RED":
-                    if count != 0:
-                        fen += str(count)
-                        count = 0
-                    fen += 'R'
-                elif self._board[rank][file].get_piece() == "BLACK":
-                    if count != 0:
-                        fen += str(count)
-                        count = 0
-                    fen += 'B'
-                else:
-                    count += 1
-            if count > 0:
-                fen += str(count)
-            fen += '/'
-        return fen[:-1]
+        return self._position.to_fen()
 
     def draw(self, win):
         """Draws the board onto the screen"""
+        import pygame as pg
         weight = 5
         font = pg.font.SysFont(None, 50)
         color = (0, 0, 0)
@@ -592,76 +483,79 @@ class Board:
 
 
 class Square:
-    """Square node that is part of the board. It is connected to other squares in 4 directions"""
-    def __init__(self, piece: str, top: 'Square', left: 'Square', row: int, col: int, width: int, height: int, buffer: int):
-        """Initialize squares using the connected top and left squares (going left to right/top to bottom)"""
-        self._piece = piece
-        self._top = top
-        self._right = None
-        self._bottom = None
-        self._left = left
-        self._row = row
-        self._col = col
-        self._width = width
-        self._height = height
-        self._buffer = buffer
-        self._selected = False
-        self._is_possible = False
-        self.x = (self._col - 1) * self._width + self._buffer + 3
-        self.y = self._row * self._width + self._height - 3 * self._buffer + 7
+    """
+    Square of the board, a view that shows the piece the board's position has on it and the board's flags for it.
+    It is connected to other squares in 4 directions through the NEIGHBORS table
+    """
+    __slots__ = ('_owner', '_square', 'x', 'y', '_random_num', '_flip_x', '_flip_y')
+
+    def __init__(self, board: 'Board', square: int):
+        """Initialize the square with its place on the screen and a random rotation and flip of the tile"""
+        self._owner = board
+        self._square = square
+        rank, file = divmod(square, 9)
+        self.x = file * board.get_gap() + board.get_buffer() + 3
+        self.y = (rank + 1) * board.get_gap() + board.get_top_gap() - 3 * board.get_buffer() + 7
         self._random_num = random.randint(0, 3)
         self._flip_x = True if random.randint(0, 1) == 1 else False
         self._flip_y = True if random.randint(0, 1) == 1 else False
 
     def get_piece(self) -> str:
         """returns the piece on the square"""
-        return self._piece
+        side = self._owner.get_position().occupant(self._square)
+        return "NONE" if side is None else PLAYERS[side]
 
     def set_is_possible(self, possible: bool) -> None:
         """set bool value to whether or not the square is possible for next move"""
-        self._is_possible = possible
+        self._owner.set_flag(self._square, Board.POSSIBLE, possible)
 
     def set_selected(self, selected: bool) -> None:
         """Sets if the square is selected"""
-        self._selected = selected
+        self._owner.set_flag(self._square, Board.SELECTED, selected)
 
-    def set_bottom_and_right(self, bottom: "Square", right: "Square") -> None:
-        """Sets the bottom and right connected squares on a separate pass through"""
-        self._bottom = bottom
-        self._right = right
+    def _neighbor(self, direction: int) -> Union['Square', None]:
+        """returns the square next to this one in direction of DIRECTIONS, None at the edge"""
+        square = NEIGHBORS[direction][self._square]
+        return None if square < 0 else self._owner.square(square)
 
     def get_top(self) -> 'Square':
         """returns the square that is connected above"""
-        return self._top
+        return self._neighbor(3)
 
     def get_bottom(self) -> 'Square':
         """returns the square that is connected below"""
-        return self._bottom
+        return self._neighbor(1)
 
     def get_right(self) -> 'Square':
         """returns the square that is connected to the right"""
-        return self._right
+        return self._neighbor(0)
 
     def get_left(self) -> 'Square':
         """returns the square that is connected to the left"""
-        return self._left
+        return self._neighbor(2)
 
     def set_piece(self, piece: str) -> None:
         """sets any piece that is on the square"""
-        self._piece = piece
+        self._owner.set_piece(self._square, None if piece == "NONE" else PLAYERS.index(piece))
 
     def get_location(self):
         """returns the location of this square"""
-        return self._row, self._col
+        return self._square // 9 + 1, self._square % 9 + 1
+
+    def get_square(self) -> int:
+        """returns the Position square (rank * 9 + file) of this square"""
+        return self._square
 
     def draw(self, win: Union["Surface", "SurfaceType"]):
         """Draws the pieces onto the board and colors any squares. Green possible move and gray current selection"""
+        import pygame as pg
+        images = load_images()
 
         # wooden tile
         win.blit(
             pg.transform.flip(
                 pg.transform.rotate(
-                    WOOD_TILE, 90 * self._random_num    # rotates a random amount
+                    images['WOOD_TILE'], 90 * self._random_num  # rotates a random amount
                 ),
                 self._flip_x,                           # random horizontal flip
                 self._flip_y                            # random vertical flip
@@ -669,59 +563,1027 @@ class Square:
             (self.x, self.y)                            # the top left of each square
         )
 
-        if self._piece == 'BLACK':                      # draw black piece
+        piece = self.get_piece()
+        if piece == 'BLACK':                            # draw black piece
             win.blit(
-                BLACK_PIECE,
+                images['BLACK_PIECE'],
                 (self.x+2, self.y+2)
             )
-        elif self._piece == 'RED':                      # draw red piece
+        elif piece == 'RED':                            # draw red piece
             win.blit(
-                pg.transform.rotate(RED_PIECE, 180),    # rotate red piece to look down
+                pg.transform.rotate(images['RED_PIECE'], 180),     # rotate red piece to look down
                 (self.x+2, self.y+2)
             )
 
         # draw gray box around selected piece
-        if self._selected:
+        width = self._owner.get_gap()
+        if self._owner.get_flag(self._square, Board.SELECTED):
             color = (125, 125, 125)
             pg.draw.rect(
                 win,
                 color,
-                pg.Rect(self.x, self.y, self._width - 5, self._width - 5),
+                pg.Rect(self.x, self.y, width - 5, width - 5),
                 5
             )
         # draw green box around squares that you can move to
-        elif self._is_possible:
+        elif self._owner.get_flag(self._square, Board.POSSIBLE):
             color = (0, 200, 0)
             pg.draw.rect(
                 win,
                 color,
-                pg.Rect(self.x, self.y, self._width - 5, self._width - 5),
+                pg.Rect(self.x, self.y, width - 5, width - 5),
                 5
             )
 
 
+PLAYERS: Tuple[str, str] = ("BLACK", "RED")           # index of the player is its side in a Position
+DIRECTIONS: List[Tuple[int, int]] = [(0, 1), (1, 0), (0, -1), (-1, 0)]     # right, bottom, left, top
+CORNERS: List[Tuple[int, int, int]] = [(0, 1, 9), (8, 7, 17), (80, 79, 71), (72, 73, 63)]  # corner, neighbors
+WIN_SCORE = 1000
+MAX_PLY = 64
+ASPIRATION_WINDOW = 25                                # each iteration first searches this close to the last score
+NULL_MOVE_REDUCTION = 2                               # plies less that the search after passing goes
+FUTILITY_MARGIN = 30                                  # most a quiet move one ply from the leaves can gain
+
+
+def _build_rays() -> List[List[int]]:
+    """Builds the bitboard of the squares from each square to the edge, for every direction in DIRECTIONS"""
+    rays = []
+    for d_rank, d_file in DIRECTIONS:
+        rays.append([])
+        for square in range(81):
+            ray = 0
+            rank, file = divmod(square, 9)
+            rank, file = rank + d_rank, file + d_file
+            while 0 <= rank < 9 and 0 <= file < 9:
+                ray |= 1 << (rank * 9 + file)
+                rank, file = rank + d_rank, file + d_file
+            rays[-1].append(ray)
+    return rays
+
+
+# RAYS[direction][square], right and bottom rays go up in square number and left and top rays go down
+RAYS: List[List[int]] = _build_rays()
+# FILES_BEFORE[file] and FILES_AFTER[file] have every square of the files left and right of file
+FILES_BEFORE: List[int] = [sum(((1 << file) - 1) << rank * 9 for rank in range(9)) for file in range(9)]
+FILES_AFTER: List[int] = [sum((0x1FF ^ ((1 << file + 1) - 1)) << rank * 9 for rank in range(9)) for file in range(9)]
+# NEIGHBORS[direction][square] is the square next to square in each direction of DIRECTIONS or -1 at the edge
+NEIGHBORS: List[List[int]] = [
+    [(ray & -ray).bit_length() - 1 if direction < 2 else ray.bit_length() - 1 for ray in RAYS[direction]]
+    for direction in range(4)
+]
+# byte translation table that clears the Board.POSSIBLE flag and keeps the others
+POSSIBLE_CLEARED = bytes(flags & ~Board.POSSIBLE for flags in range(256))
+# ADJACENT[square] has the squares next to square, the first square of each ray
+ADJACENT: List[int] = [
+    RAYS[0][square] & -RAYS[0][square] | RAYS[1][square] & -RAYS[1][square]
+    | (1 << RAYS[2][square].bit_length() >> 1) | (1 << RAYS[3][square].bit_length() >> 1)
+    for square in range(81)
+]
+
+# random 64 bit keys for a piece of each side on each square and for RED to move. The seed is fixed so that
+# hashes are the same in every process and between runs
+_zobrist_random = random.Random(2021)
+ZOBRIST: List[List[int]] = [[_zobrist_random.getrandbits(64) for _ in range(81)] for _ in range(2)]
+ZOBRIST_SIDE: int = _zobrist_random.getrandbits(64)
+
+
+class Position:
+    """
+    Bitboard representation of a board used by the AI search. Each side is an 81 bit integer that has
+    bit rank * 9 + file set when the side has a piece there. Side 0 is BLACK and side 1 is RED.
+    """
+    def __init__(self, black: int = 0, red: int = 0, side: int = 0):
+        """initializes the bitboards of both sides and the side that moves next"""
+        self._pieces: List[int] = [black, red]
+        self._side = side
+        self._hash = ZOBRIST_SIDE if side else 0
+        for piece_side in (0, 1):
+            pieces = self._pieces[piece_side]
+            while pieces:
+                bit = pieces & -pieces
+                self._hash ^= ZOBRIST[piece_side][bit.bit_length() - 1]
+                pieces ^= bit
+        # pattern of every rank (0 - 8) and file (9 - 17) as an index to the line tables, and the open score
+        # of all of them. Both are kept up to date by make and unmake
+        if not OPEN_TABLE:
+            _build_line_tables()
+        self._lines: List[int] = [0] * 18
+        self._open_total = 0
+        for piece_side in (0, 1):
+            pieces = self._pieces[piece_side]
+            while pieces:
+                bit = pieces & -pieces
+                self._toggle(piece_side, bit.bit_length() - 1, 1)
+                pieces ^= bit
+
+    @classmethod
+    def from_fen(cls, board: str, player: str = "BLACK") -> 'Position':
+        """Creates a position from FEN with player to move"""
+        pieces = [0, 0]
+        for rank, row in enumerate(board.split('/')):
+            file = 0
+            for char in row:
+                if char == 'B':
+                    pieces[0] |= 1 << (rank * 9 + file)
+                    file += 1
+                elif char == 'R':
+                    pieces[1] |= 1 << (rank * 9 + file)
+                    file += 1
+                else:
+                    file += int(char)
+        return cls(pieces[0], pieces[1], PLAYERS.index(player))
+
+    def to_fen(self) -> str:
+        """generates FEN representation of the position"""
+        black, red = self._pieces
+        rows = []
+        for rank in range(9):
+            row = ''
+            count = 0
+            for square in range(rank * 9, rank * 9 + 9):
+                if (black | red) >> square & 1:
+                    if count:
+                        row += str(count)
+                        count = 0
+                    row += 'B' if black >> square & 1 else 'R'
+                else:
+                    count += 1
+            if count:
+                row += str(count)
+            rows.append(row)
+        return '/'.join(rows)
+
+    def get_side(self) -> int:
+        """returns the side that moves next"""
+        return self._side
+
+    def get_pieces(self, side: int) -> int:
+        """returns the bitboard of the given side"""
+        return self._pieces[side]
+
+    def count(self, side: int) -> int:
+        """returns how many pieces the side has left"""
+        return self._pieces[side].bit_count()
+
+    def get_hash(self) -> int:
+        """returns the 64 bit zobrist hash of the pieces and the side to move"""
+        return self._hash
+
+    def key(self) -> int:
+        """returns a single integer that identifies the pieces on the board"""
+        return self._pieces[0] << 81 | self._pieces[1]
+
+    def get_lines(self) -> List[int]:
+        """returns the line table index of every rank (0 - 8) and file (9 - 17)"""
+        return self._lines
+
+    def occupant(self, square: int) -> Union[int, None]:
+        """returns the side that has a piece on square or None when it is empty"""
+        if self._pieces[0] >> square & 1:
+            return 0
+        if self._pieces[1] >> square & 1:
+            return 1
+        return None
+
+    def set_piece(self, square: int, side: Union[int, None]) -> None:
+        """Puts a piece of side on square, or empties it when side is None, keeping the hash and lines up to date"""
+        current = self.occupant(square)
+        if current == side:
+            return
+        if current is not None:
+            self._pieces[current] ^= 1 << square
+            self._hash ^= ZOBRIST[current][square]
+            self._toggle(current, square, -1)
+        if side is not None:
+            self._pieces[side] ^= 1 << square
+            self._hash ^= ZOBRIST[side][square]
+            self._toggle(side, square, 1)
+
+    def is_legal(self, move: Tuple[int, int]) -> bool:
+        """returns if there is a piece on the from square that can slide to the to square"""
+        from_square, to_square = move
+        occupied = self._pieces[0] | self._pieces[1]
+        return bool(occupied >> from_square & 1 and self.destinations(from_square, occupied) >> to_square & 1)
+
+    def moves(self) -> List[Tuple[int, int]]:
+        """Finds every (from, to) square pair the side to move can play"""
+        occupied = self._pieces[0] | self._pieces[1]
+        moves = []
+        pieces = self._pieces[self._side]
+        while pieces:
+            bit = pieces & -pieces
+            square = bit.bit_length() - 1
+            targets = self.destinations(square, occupied)
+            while targets:
+                target = targets & -targets
+                moves.append((square, target.bit_length() - 1))
+                targets ^= target
+            pieces ^= bit
+        return moves
+
+    @staticmethod
+    def destinations(square: int, occupied: int) -> int:
+        """Returns the bitboard of every square a piece on square can slide to using the ray tables"""
+        # cut each ray at the first piece on it, the nearest piece is the lowest bit for right and bottom
+        ray = RAYS[0][square]
+        blockers = ray & occupied
+        if blockers:
+            blocker = (blockers & -blockers).bit_length() - 1
+            ray ^= RAYS[0][blocker] | 1 << blocker
+        targets = ray
+
+        ray = RAYS[1][square]
+        blockers = ray & occupied
+        if blockers:
+            blocker = (blockers & -blockers).bit_length() - 1
+            ray ^= RAYS[1][blocker] | 1 << blocker
+        targets |= ray
+
+        # and the highest bit for left and top
+        ray = RAYS[2][square]
+        blockers = ray & occupied
+        if blockers:
+            blocker = blockers.bit_length() - 1
+            ray ^= RAYS[2][blocker] | 1 << blocker
+        targets |= ray
+
+        ray = RAYS[3][square]
+        blockers = ray & occupied
+        if blockers:
+            blocker = blockers.bit_length() - 1
+            ray ^= RAYS[3][blocker] | 1 << blocker
+        return targets | ray
+
+    def captures(self, move: Tuple[int, int]) -> int:
+        """returns how many opponent pieces move would capture, without playing it"""
+        from_square, to_square = move
+        if not ADJACENT[to_square] & self._pieces[self._side ^ 1]:     # nothing to sandwich next to it
+            return 0
+        pieces = self._pieces[:]
+        pieces[self._side] ^= 1 << from_square | 1 << to_square
+        return self.capture(pieces, self._side, to_square)[self._side ^ 1].bit_count()
+
+    def capture_moves(self) -> List[Tuple[int, int]]:
+        """Finds the moves of the side to move that capture opponent pieces, the ones that take the most first"""
+        opponent = self._pieces[self._side ^ 1]
+        near = 0                                    # a capture has to end next to an opponent piece
+        pieces = opponent
+        while pieces:
+            bit = pieces & -pieces
+            near |= ADJACENT[bit.bit_length() - 1]
+            pieces ^= bit
+        occupied = self._pieces[0] | self._pieces[1]
+        scored = []
+        pieces = self._pieces[self._side]
+        while pieces:
+            bit = pieces & -pieces
+            square = bit.bit_length() - 1
+            targets = self.destinations(square, occupied) & near
+            while targets:
+                target = targets & -targets
+                captures = self.captures((square, target.bit_length() - 1))
+                if captures:
+                    scored.append((captures, (square, target.bit_length() - 1)))
+                targets ^= target
+            pieces ^= bit
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+    def pass_turn(self) -> None:
+        """Gives the move to the other side without moving, for null-move pruning. Passing again takes it back"""
+        self._side ^= 1
+        self._hash ^= ZOBRIST_SIDE
+
+    def copy(self) -> 'Position':
+        """returns a copy of the position"""
+        return Position(self._pieces[0], self._pieces[1], self._side)
+
+    def play(self, move: Tuple[int, int]) -> 'Position':
+        """Returns a new position after the side to move plays move, this position is not changed"""
+        position = self.copy()
+        position.make(move)
+        return position
+
+    def make(self, move: Tuple[int, int]) -> Tuple[int, int, int, int, int, List[int], int]:
+        """
+        Plays move in place for the side to move and removes its captures. Returns the undo record (from, to,
+        captured BLACK pieces, captured RED pieces, previous hash, previous line patterns and open score)
+        """
+        from_square, to_square = move
+        side = self._side
+        undo_lines, undo_open, previous_hash = self._lines[:], self._open_total, self._hash
+        self._pieces[side] ^= 1 << from_square | 1 << to_square
+        self._hash ^= ZOBRIST[side][from_square] ^ ZOBRIST[side][to_square] ^ ZOBRIST_SIDE
+        self._toggle(side, from_square, -1)
+        self._toggle(side, to_square, 1)
+        captured = self.remove_captures(side, to_square)
+        self._side ^= 1
+        return from_square, to_square, captured[0], captured[1], previous_hash, undo_lines, undo_open
+
+    def unmake(self, undo: Tuple[int, int, int, int, int, List[int], int]) -> None:
+        """Takes back the move that returned the undo record"""
+        from_square, to_square, captured_black, captured_red, self._hash, self._lines, self._open_total = undo
+        self._side ^= 1
+        self._pieces[0] |= captured_black
+        self._pieces[1] |= captured_red
+        self._pieces[self._side] ^= 1 << from_square | 1 << to_square
+
+    def remove_captures(self, side: int, square: int) -> List[int]:
+        """Removes the pieces captured by the piece of side that just moved onto square, returns them for each side"""
+        captured = self.capture(self._pieces, side, square)
+        for captured_side in (0, 1):
+            pieces = captured[captured_side]
+            while pieces:
+                bit = pieces & -pieces
+                square = bit.bit_length() - 1
+                self._hash ^= ZOBRIST[captured_side][square]
+                self._toggle(captured_side, square, -1)
+                pieces ^= bit
+        return captured
+
+    def _toggle(self, side: int, square: int, sign: int) -> None:
+        """Adds (sign 1) or removes (sign -1) a piece of side in the rank and file patterns of square"""
+        rank, file = divmod(square, 9)
+        lines = self._lines
+        old_rank, old_file = lines[rank], lines[9 + file]
+        lines[rank] = new_rank = old_rank + sign * (side + 1) * POW3[file]
+        lines[9 + file] = new_file = old_file + sign * (side + 1) * POW3[rank]
+        self._open_total += OPEN_TABLE[new_rank] - OPEN_TABLE[old_rank] + OPEN_TABLE[new_file] - OPEN_TABLE[old_file]
+
+    @staticmethod
+    def capture(pieces: List[int], side: int, square: int) -> List[int]:
+        """
+        Removes the pieces captured by side moving onto square, following the rules in Board.capture_pieces:
+        opponent lines sandwiched in all 4 directions, then any corner piece surrounded by 2 opponent pieces.
+        Returns the captured pieces of each side
+        """
+        own, opponent = pieces[side], pieces[side ^ 1]
+        captured = [0, 0]
+        for direction in range(4):
+            ray = RAYS[direction][square]
+            stops = ray & ~opponent                 # the first square that isn't an opponent ends the line
+            if not stops:
+                continue
+            stop = (stops & -stops).bit_length() - 1 if direction < 2 else stops.bit_length() - 1
+            if own >> stop & 1:                     # own piece closes the sandwich
+                captured[side ^ 1] |= ray ^ RAYS[direction][stop] ^ 1 << stop
+
+        pieces[side ^ 1] ^= captured[side ^ 1]
+        for corner, neighbor_1, neighbor_2 in CORNERS:
+            for owner in (0, 1):
+                other = pieces[owner ^ 1]
+                if pieces[owner] >> corner & 1 and other >> neighbor_1 & 1 and other >> neighbor_2 & 1:
+                    pieces[owner] ^= 1 << corner
+                    captured[owner] |= 1 << corner
+        return captured
+
+    def winner(self) -> Union[int, None]:
+        """returns the side that won, the side that just moved is checked first like HasamiShogiGame does"""
+        mover = self._side ^ 1
+        if self.count(self._side) <= 1:
+            return mover
+        if self.count(mover) <= 1:
+            return self._side
+        return None
+
+    def evaluate(self, side: int) -> int:
+        """Evaluates the position for side. Scores are computed for RED and flipped for BLACK"""
+        black, red = self.count(0), self.count(1)
+        if black <= 1:
+            score = WIN_SCORE
+        elif red <= 1:
+            score = -WIN_SCORE
+        else:
+            black_pieces, red_pieces = self._pieces
+            surround_score = self._surround_score(red_pieces, black_pieces) \
+                - self._surround_score(black_pieces, red_pieces)
+            score = (red - black) * 10 + surround_score + self._open_total // max(red, black)
+        return score if side == 1 else -score
+
+    @staticmethod
+    def _open_score(line: List[int]) -> int:
+        """
+        Scores how exposed the pieces of a line are for RED minus BLACK. Looking both ways from a piece,
+        own pieces before an empty square count against it and opponent pieces up to the edge count for it
+        """
+        score = 0
+        for index, piece in enumerate(line):
+            if piece == 0:
+                continue
+            piece_score = 0
+            for step, end in ((-1, -1), (1, 9)):
+                good_pieces = 0
+                bad_pieces = 0
+                for position in range(index + step, end, step):
+                    if line[position] == 0:             # open square, own pieces before it are exposed
+                        piece_score -= bad_pieces
+                        break
+                    if line[position] == piece:
+                        bad_pieces += 1
+                    else:
+                        good_pieces += 1
+                else:                                   # reached the edge without an open square
+                    piece_score += good_pieces
+            score += piece_score if piece == 2 else -piece_score
+        return score
+
+    @staticmethod
+    def _surround_score(own: int, opponent: int) -> int:
+        """
+        Counts the own pieces that are past every opponent piece from each side of the board,
+        opponent can't be empty
+        """
+        first_rank = ((opponent & -opponent).bit_length() - 1) // 9
+        last_rank = (opponent.bit_length() - 1) // 9
+        above = (own & ((1 << first_rank * 9) - 1)).bit_count()
+        below = (own >> (last_rank * 9 + 9)).bit_count()
+
+        # fold the ranks onto each other to find the files that have an opponent piece
+        files = opponent
+        for shift in (72, 36, 18, 9):
+            files |= files >> shift
+        files &= 0x1FF
+        left = (own & FILES_BEFORE[(files & -files).bit_length() - 1]).bit_count()
+        right = (own & FILES_AFTER[files.bit_length() - 1]).bit_count()
+        return min(above, below) * 2 + min(left, right) * 2
+
+    @staticmethod
+    def to_location(square: int) -> Tuple[int, int]:
+        """converts a square to the (rank, file) location counting from 1 that the AI uses"""
+        rank, file = divmod(square, 9)
+        return rank + 1, file + 1
+
+    @staticmethod
+    def to_square(location: Tuple[int, int]) -> int:
+        """converts a (rank, file) location counting from 1 to a square"""
+        return (location[0] - 1) * 9 + location[1] - 1
+
+
+POW3: List[int] = [3 ** index for index in range(9)]
+# Scores of every possible rank or file, indexed by the sum of piece * 3 ** index with 0 for empty, 1 for BLACK
+# and 2 for RED. OPEN_TABLE is Position._open_score and LEFT_OPEN_TABLE[side] is Board._left_open_pieces for the
+# pieces of side. They are built the first time a Position is created
+OPEN_TABLE: List[int] = []
+LEFT_OPEN_TABLE: List[List[int]] = [[], []]
+
+
+def _build_line_tables() -> None:
+    """Scores all 3 ** 9 line patterns for the line tables"""
+    for pattern in range(3 ** 9):
+        line = [pattern // power % 3 for power in POW3]
+        OPEN_TABLE.append(Position._open_score(line))
+        for side in (0, 1):
+            LEFT_OPEN_TABLE[side].append(Board._left_open_pieces(line, side + 1))
+
+
+def boards_from_bitboards(black: List[int], red: List[int]) -> 'np.ndarray':
+    """Converts lists of BLACK and RED bitboards to an (N, 9, 9) int8 array of 0 empty, 1 BLACK and 2 RED"""
+    black_bytes = b''.join(pieces.to_bytes(11, 'little') for pieces in black)
+    red_bytes = b''.join(pieces.to_bytes(11, 'little') for pieces in red)
+    black_bits = np.unpackbits(np.frombuffer(black_bytes, np.uint8).reshape(-1, 11), axis=1, bitorder='little')
+    red_bits = np.unpackbits(np.frombuffer(red_bytes, np.uint8).reshape(-1, 11), axis=1, bitorder='little')
+    return (black_bits[:, :81] + 2 * red_bits[:, :81]).astype(np.int8).reshape(-1, 9, 9)
+
+
+def evaluate_batch(boards: 'np.ndarray', player: str = "RED") -> 'np.ndarray':
+    """
+    Evaluates an (N, 9, 9) array of boards (0 empty, 1 BLACK, 2 RED) for player in one vectorized pass.
+    Returns the N scores that Position.evaluate would give
+    """
+    if not OPEN_TABLE:
+        _build_line_tables()
+    boards = np.asarray(boards, dtype=np.int64).reshape(-1, 9, 9)
+    powers = np.array(POW3, dtype=np.int64)
+    open_table = np.array(OPEN_TABLE, dtype=np.int64)
+    open_score = open_table[boards @ powers].sum(axis=1) + open_table[powers @ boards].sum(axis=1)
+
+    black_pieces, red_pieces = boards == 1, boards == 2
+    black, red = black_pieces.sum(axis=(1, 2)), red_pieces.sum(axis=(1, 2))
+    surround_score = _surround_batch(red_pieces, black_pieces) - _surround_batch(black_pieces, red_pieces)
+    scores = (red - black) * 10 + surround_score + open_score // np.maximum(np.maximum(red, black), 1)
+    scores = np.where(black <= 1, WIN_SCORE, np.where(red <= 1, -WIN_SCORE, scores))
+    return scores if player == "RED" else -scores
+
+
+def _surround_batch(own: 'np.ndarray', opponent: 'np.ndarray') -> 'np.ndarray':
+    """Position._surround_score for (N, 9, 9) boolean arrays of own and opponent pieces"""
+    totals = []
+    for axis in (2, 1):                             # ranks, then files
+        own_count = own.sum(axis=axis)
+        clear = ~opponent.any(axis=axis)            # lines without an opponent piece
+        before = np.cumprod(clear, axis=1)          # lines before the first opponent line
+        after = np.cumprod(clear[:, ::-1], axis=1)[:, ::-1]
+        totals.append(np.minimum((own_count * before).sum(axis=1), (own_count * after).sum(axis=1)) * 2)
+    return totals[0] + totals[1]
+
+
+# RAY_SQUARES[square][direction][step] is the square step + 1 squares from square in each direction of DIRECTIONS,
+# or 81 past the edge, which playout_batch keeps as an off board column
+RAY_SQUARES: List[List[List[int]]] = [
+    [[(rank + d_rank * step) * 9 + file + d_file * step
+      if 0 <= rank + d_rank * step < 9 and 0 <= file + d_file * step < 9 else 81 for step in range(1, 9)]
+     for d_rank, d_file in DIRECTIONS]
+    for rank, file in (divmod(square, 9) for square in range(81))
+]
+
+
+def playout_batch(boards: 'np.ndarray', sides: Union[int, 'np.ndarray'], turns: int,
+                  rng: Union['np.random.Generator', None] = None) -> 'np.ndarray':
+    """
+    Plays random games from an (N, 9, 9) array of boards (0 empty, 1 BLACK, 2 RED) in lockstep, every game one
+    uniformly random move a turn, for at most turns moves. sides is the side to move (0 BLACK, 1 RED) of every
+    board or of all of them. Returns the N sides that won, a game that isn't won by then goes to the side with
+    more pieces and -1 is a draw. A side that can't move loses, like in _playout
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    # the games are the last axis so every step works on long rows, row 81 is off the board
+    cells = np.full((82, len(boards)), 3, dtype=np.int8)
+    cells[:81] = np.asarray(boards, dtype=np.int8).reshape(-1, 81).T
+    side = np.broadcast_to(np.asarray(sides, dtype=np.int8), (len(boards),)).copy()
+    winners = np.full(len(boards), -1, dtype=np.int8)
+    active = np.ones(len(boards), dtype=bool)
+    ray_squares = np.array(RAY_SQUARES, dtype=np.intp)
+    for _ in range(turns):
+        if not active.any():
+            break
+        # finished games stay in the arrays, which is faster than taking them out, but don't move
+        moved = _play_batch(cells, side, active, ray_squares, rng)
+        black, red = (cells[:81] == 1).sum(axis=0, dtype=np.int8), (cells[:81] == 2).sum(axis=0, dtype=np.int8)
+        own, other = np.where(side == 0, black, red), np.where(side == 0, red, black)
+        # the side that moved is checked first, like Position.winner
+        won = np.where(moved & (other <= 1), side, side ^ 1)
+        done = active & (~moved | (own <= 1) | (other <= 1))
+        winners[done] = won[done]
+        active &= ~done
+        side ^= 1
+    black, red = (cells[:81] == 1).sum(axis=0, dtype=np.int8), (cells[:81] == 2).sum(axis=0, dtype=np.int8)
+    winners[active] = np.where(black > red, 0, np.where(red > black, 1, -1))[active]
+    return winners
+
+
+def _play_batch(cells: 'np.ndarray', sides: 'np.ndarray', active: 'np.ndarray', ray_squares: 'np.ndarray',
+                rng: 'np.random.Generator') -> 'np.ndarray':
+    """
+    Plays a uniformly random move for sides on each active column of the (82, N) cells of playout_batch in place
+    and removes its captures, following the rules in Position.capture. Returns which boards had a move
+    """
+    games = np.arange(cells.shape[1])
+    own = (sides + 1).astype(np.int8)
+    # open squares in a row from every square in each direction of DIRECTIONS, one rank or file at a time
+    empty = (cells[:81] == 0).reshape(9, 9, -1).astype(np.int16)
+    free = np.zeros((4, 9, 9, len(games)), dtype=np.int16)
+    for index in range(7, -1, -1):
+        free[0, :, index] = empty[:, index + 1] * (1 + free[0, :, index + 1])
+        free[1, index] = empty[index + 1] * (1 + free[1, index + 1])
+        free[2, :, 8 - index] = empty[:, 7 - index] * (1 + free[2, :, 7 - index])
+        free[3, 8 - index] = empty[7 - index] * (1 + free[3, 7 - index])
+    # moves of the side to move by (direction, square), and the picks-th of them counting in that order
+    legal = (free.reshape(4, 81, -1) * ((cells[:81] == own) & active)).reshape(324, -1)
+    totals = legal.copy()
+    for index in range(1, 324):                 # a running sum a row at a time is faster than np.cumsum on axis 0
+        totals[index] += totals[index - 1]
+    picks = (rng.random(len(games)) * totals[-1]).astype(np.int16)
+    lines = (totals <= picks).sum(axis=0)
+    moved = totals[-1] > 0
+    games, own, picks, lines = games[moved], own[moved], picks[moved], lines[moved]
+    steps = picks - totals[lines, games] + legal[lines, games]
+    from_squares = lines % 81
+    to_squares = ray_squares[from_squares, lines // 81, steps]
+    cells[from_squares, games] = 0
+    cells[to_squares, games] = own
+
+    # sandwiches: a run of opponent pieces from the moved piece closed by an own piece, in all 4 directions
+    lines = ray_squares[to_squares]
+    line_cells = cells[lines, games[:, None, None]]
+    run = np.logical_and.accumulate(line_cells == (3 - own)[:, None, None], axis=2)
+    lengths = run.sum(axis=2)
+    ends = np.take_along_axis(line_cells, np.minimum(lengths, 7)[:, :, None], axis=2)[:, :, 0]
+    closed = (lengths < 8) & (ends == own[:, None])
+    captured = run & closed[:, :, None]
+    cells[lines[captured], np.broadcast_to(games[:, None, None], lines.shape)[captured]] = 0
+
+    # then any corner piece with opponent pieces on both of its neighbors
+    for corner, neighbor_1, neighbor_2 in CORNERS:
+        owner = cells[corner]
+        surrounded = (owner > 0) & (cells[neighbor_1] == 3 - owner) & (cells[neighbor_2] == 3 - owner)
+        cells[corner, surrounded] = 0
+    return moved
+
+
+class TranspositionTable:
+    """
+    Fixed size hash table of search results keyed by zobrist hash. Each bucket holds a depth-preferred entry
+    and an always-replace entry, and each entry is 2 words: the hash xor the data, and the data which packs the
+    depth, bound, score, best move and the search generation that stored it. The table can live in shared
+    memory for several processes, the xor makes an entry that was half written by another process not match
+    """
+    EXACT, LOWER, UPPER = 0, 1, 2
+
+    def __init__(self, size_mb: float = 16, shared: bool = False, name: Union[str, None] = None):
+        """
+        initializes an empty table that uses about size_mb megabytes. A shared table is created in shared
+        memory and a name attaches to the shared table of that name, which must have the same size
+        """
+        self._buckets = max(1, int(size_mb * 1024 * 1024) // 32)      # 4 words of 8 bytes per bucket
+        self._generation = 0
+        self._owner = shared
+        self._memory: Union[shared_memory.SharedMemory, None] = None
+        if shared or name is not None:
+            self._memory = shared_memory.SharedMemory(name=name, create=shared, size=self._buckets * 32)
+            self._table = self._memory.buf.cast('Q')
+        else:
+            self._table = array('Q', bytes(self._buckets * 32))
+
+    def get_name(self) -> Union[str, None]:
+        """returns the name of the shared memory of the table, None if it isn't shared"""
+        return self._memory.name if self._memory is not None else None
+
+    def get_generation(self) -> int:
+        """returns the generation that new entries are stored with"""
+        return self._generation
+
+    def set_generation(self, generation: int) -> None:
+        """sets the generation, so processes sharing the table agree on which entries are old"""
+        self._generation = generation & 0xFF
+
+    def new_search(self) -> None:
+        """starts a new generation so entries from older searches are replaced first"""
+        self._generation = (self._generation + 1) & 0xFF
+
+    def clear(self) -> None:
+        """removes every entry"""
+        if self._memory is not None:
+            self._memory.buf[:self._buckets * 32] = bytes(self._buckets * 32)
+        else:
+            self._table = array('Q', bytes(self._buckets * 32))
+
+    def close(self) -> None:
+        """Detaches from the shared memory, and frees it if this table created it"""
+        if self._memory is not None:
+            self._table.release()
+            self._memory.close()
+            if self._owner:
+                self._memory.unlink()
+            self._memory = None
+            self._table = array('Q', bytes(self._buckets * 32))
+
+    def probe(self, key: int) -> Union[Tuple[int, int, int, Union[Tuple[int, int], None]], None]:
+        """returns (depth, bound, score, best move) stored for the hash or None if it isn't in the table"""
+        index = key % self._buckets * 4
+        table = self._table
+        data = table[index + 1]
+        if table[index] ^ data != key:
+            data = table[index + 3]
+            if table[index + 2] ^ data != key:
+                return None
+        if not data:                                    # an empty slot that a key of 0 happened to match
+            return None
+        move = data >> 26 & 0x1FFF
+        return data >> 16 & 0xFF, data >> 24 & 0x3, (data & 0xFFFF) - 0x8000, \
+            divmod(move - 1, 81) if move else None
+
+    def store(self, key: int, depth: int, bound: int, score: int, move: Union[Tuple[int, int], None]) -> None:
+        """Stores a search result, keeping the deeper or newer result in the depth-preferred entry"""
+        index = key % self._buckets * 4
+        table = self._table
+        data = (score + 0x8000) | depth << 16 | bound << 24 \
+            | (move[0] * 81 + move[1] + 1 if move else 0) << 26 | self._generation << 40
+        old = table[index + 1]
+        same_key = table[index] ^ old == key
+        # entries of the last search count as current, the next search starts where it left off
+        if same_key or not old or depth >= (old >> 16 & 0xFF) or (self._generation - (old >> 40)) & 0xFF > 1:
+            if not same_key and old:                    # move the replaced entry to the always-replace slot
+                table[index + 2], table[index + 3] = table[index], old
+            table[index], table[index + 1] = key ^ data, data
+        else:
+            table[index + 2], table[index + 3] = key ^ data, data
+
+    def evaluations(self) -> Dict[int, int]:
+        """returns the static evaluations (exact depth 0 entries) in the table by hash"""
+        evaluations = {}
+        table = self._table
+        for index in range(0, len(table), 2):
+            data = table[index + 1]
+            if data and data >> 16 & 0x3FF == 0:        # depth 0 and EXACT
+                evaluations[table[index] ^ data] = (data & 0xFFFF) - 0x8000
+        return evaluations
+
+
+class RecordFile:
+    """
+    Binary file of records keyed by zobrist hash. The file is an open addressing hash table: a 16 byte header with
+    the magic and the number of records, then a power of 2 number of slots of 2 words, the hash and the data, which
+    is never 0 so that an empty slot is all zeros. The file is memory-mapped read-only, so opening it doesn't depend
+    on its size, and merge writes new records into it in place
+    """
+    MAGIC = b'HSRF0001'
+    HEADER = struct.Struct('<8sQ')
+
+    def __init__(self, path: str):
+        """opens the file at path, a missing or unreadable file has no records until something is merged"""
+        self._path = path
+        self._map: Union[mmap.mmap, None] = None
+        self._table: Union[memoryview, None] = None
+        self._slots = 0
+        self._count = 0
+        self._open()
+
+    def _open(self) -> None:
+        """Maps the file read-only if it has the magic of this class"""
+        try:
+            with open(self._path, 'rb') as in_file:
+                self._map = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):                   # missing or empty file
+            return
+        if len(self._map) < self.HEADER.size or self._map[:len(self.MAGIC)] != self.MAGIC:
+            self.close()
+            return
+        self._count = self.HEADER.unpack_from(self._map)[1]
+        self._table = memoryview(self._map)[self.HEADER.size:].cast('Q')
+        self._slots = len(self._table) // 2
+
+    def close(self) -> None:
+        """Unmaps the file"""
+        if self._table is not None:
+            self._table.release()
+            self._table = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._slots = self._count = 0
+
+    def get_count(self) -> int:
+        """returns how many records are in the file"""
+        return self._count
+
+    def _probe(self, key: int) -> int:
+        """returns the data saved for the hash or 0"""
+        if not self._slots:
+            return 0
+        table = self._table
+        mask = self._slots - 1
+        index = key & mask
+        while True:
+            data = table[index * 2 + 1]
+            if not data or table[index * 2] == key:
+                return data
+            index = (index + 1) & mask
+
+    @staticmethod
+    def _insert(table: Union[memoryview, array], slots: int, key: int, data: int) -> bool:
+        """Puts the record into the slots of table, returns if the hash wasn't there yet"""
+        mask = slots - 1
+        index = key & mask
+        while table[index * 2 + 1] and table[index * 2] != key:
+            index = (index + 1) & mask
+        new = not table[index * 2 + 1]
+        table[index * 2], table[index * 2 + 1] = key, data
+        return new
+
+    def _merge(self, records: Dict[int, int]) -> None:
+        """
+        Saves the data of records into the file. They are written into the slots in place while the table stays
+        at most half full, otherwise the file is rebuilt twice as big with the old and new records
+        """
+        records = {key: data for key, data in records.items() if self._probe(key) != data}
+        if not records:
+            return
+        if (self._count + len(records)) * 2 > self._slots:
+            old_records = dict(self._records())
+            old_records.update(records)
+            self._write(old_records)
+            return
+        with open(self._path, 'r+b') as out_file:
+            writable = mmap.mmap(out_file.fileno(), 0)
+            table = memoryview(writable)[self.HEADER.size:].cast('Q')
+            count = self._count
+            for key, data in records.items():
+                count += self._insert(table, self._slots, key, data)
+            table.release()
+            self.HEADER.pack_into(writable, 0, self.MAGIC, count)
+            writable.close()
+        self.close()
+        self._open()
+
+    def _write(self, records: Dict[int, int]) -> None:
+        """Replaces the file with one that has only records, in a table at most half full"""
+        slots = 1024
+        while len(records) * 2 > slots:
+            slots *= 2
+        table = array('Q', bytes(slots * 16))
+        for key, data in records.items():
+            self._insert(table, slots, key, data)
+        self.close()
+        with open(self._path + '.tmp', 'wb') as out_file:
+            out_file.write(self.HEADER.pack(self.MAGIC, len(records)))
+            out_file.write(table.tobytes())
+        os.replace(self._path + '.tmp', self._path)
+        self._open()
+
+    def _records(self) -> List[Tuple[int, int]]:
+        """returns every (hash, data) in the file"""
+        table = self._table
+        return [(table[index], table[index + 1]) for index in range(0, self._slots * 2, 2) if table[index + 1]]
+
+
+class EvaluationCache(RecordFile):
+    """Evaluations kept between games, the data is the score + 0x8000 with bit 32 set"""
+    MAGIC = b'HSEC0001'
+
+    def get(self, key: int) -> Union[int, None]:
+        """returns the evaluation saved for the hash or None"""
+        data = self._probe(key)
+        return (data & 0xFFFF) - 0x8000 if data else None
+
+    def merge(self, evaluations: Dict[int, int]) -> None:
+        """Saves evaluations by hash into the file"""
+        self._merge({key: 1 << 32 | (score + 0x8000) for key, score in evaluations.items()})
+
+
+class OpeningBook(RecordFile):
+    """
+    Moves to play from positions reached early in self-play games, built by build_opening_book. The data packs
+    from * 81 + to + 1 of the move in 13 bits, the games it was played in in 24 bits and its points in the
+    remaining bits, 2 for each win and 1 for each draw of the side that played it
+    """
+    MAGIC = b'HSOB0001'
+
+    def get(self, key: int) -> Union[Tuple[Tuple[int, int], int, int], None]:
+        """returns (move, games, points) of the book move for the hash or None"""
+        data = self._probe(key)
+        if not data:
+            return None
+        return divmod((data & 0x1FFF) - 1, 81), data >> 13 & 0xFFFFFF, data >> 37
+
+    def write(self, moves: Dict[int, Tuple[Tuple[int, int], int, int]]) -> None:
+        """Replaces the book with moves, (move, games, points) by hash"""
+        self._write({key: (move[0] * 81 + move[1] + 1) | min(games, 0xFFFFFF) << 13 | points << 37
+                     for key, (move, games, points) in moves.items()})
+
+
+def _build_symmetries() -> List[List[int]]:
+    """Builds the square each square goes to under the 8 rotations and reflections of the board"""
+    symmetries = []
+    for transpose in (False, True):
+        for flip_rank in (False, True):
+            for flip_file in (False, True):
+                symmetries.append([])
+                for square in range(81):
+                    rank, file = divmod(square, 9)
+                    if transpose:
+                        rank, file = file, rank
+                    rank, file = 8 - rank if flip_rank else rank, 8 - file if flip_file else file
+                    symmetries[-1].append(rank * 9 + file)
+    return symmetries
+
+
+# the rules are the same in every direction, so a position and its 8 symmetries have the same value
+SYMMETRIES: List[List[int]] = _build_symmetries()
+PAIRS = 81 * 80 // 2                                    # ways to place the 2 pieces of a side
+
+
+def _pair_index(pieces: int) -> int:
+    """returns the index of a bitboard with 2 pieces among all pairs of squares"""
+    low, high = (pieces & -pieces).bit_length() - 1, pieces.bit_length() - 1
+    return high * (high - 1) // 2 + low
+
+
+class Tablebase:
+    """
+    Results of every position where both sides have 2 pieces, found by build_tablebase. The file has a 16 byte
+    header and then a 16 bit value for each pair of squares of the side to move times each pair of squares of the
+    other side. A value is the plies until the game ends with best play * 2, plus 1 when the side to move wins,
+    and 0 for a draw
+    """
+    MAGIC = b'HSTB0001'
+    HEADER = struct.Struct('<8sQ')
+
+    def __init__(self, path: str):
+        """memory-maps the tablebase at path read-only, a missing or unreadable file has no positions"""
+        self._map: Union[mmap.mmap, None] = None
+        self._values: Union[memoryview, None] = None
+        try:
+            with open(path, 'rb') as in_file:
+                self._map = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):                   # missing or empty file
+            return
+        if len(self._map) != self.HEADER.size + PAIRS * PAIRS * 2 or self._map[:len(self.MAGIC)] != self.MAGIC:
+            self.close()
+            return
+        self._values = memoryview(self._map)[self.HEADER.size:].cast('H')
+
+    def close(self) -> None:
+        """Unmaps the file"""
+        if self._values is not None:
+            self._values.release()
+            self._values = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    @staticmethod
+    def index(own: int, other: int) -> int:
+        """returns the index of the position with own pieces to move against the other pieces"""
+        return _pair_index(own) * PAIRS + _pair_index(other)
+
+    def probe(self, position: 'Position') -> Union[Tuple[bool, int], None]:
+        """
+        returns (if the side to move wins, plies until the game ends) for a position of 2 pieces against 2,
+        None when the position isn't in the tablebase or is a draw
+        """
+        if self._values is None:
+            return None
+        side = position.get_side()
+        own, other = position.get_pieces(side), position.get_pieces(side ^ 1)
+        if own.bit_count() != 2 or other.bit_count() != 2:
+            return None
+        value = self._values[self.index(own, other)]
+        return (bool(value & 1), value >> 1) if value else None
+
+    @classmethod
+    def write(cls, path: str, values: array) -> None:
+        """Writes the values of every position to path"""
+        with open(path + '.tmp', 'wb') as out_file:
+            out_file.write(cls.HEADER.pack(cls.MAGIC, len(values)))
+            out_file.write(values.tobytes())
+        os.replace(path + '.tmp', path)
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time or node budget for the move has run out"""
+    pass
+
+
 class AI:
     """Creates an AI object to play against"""
-    def __init__(self, win:  Union["Surface", "SurfaceType"], game: 'HasamiShogiGame', player: str):
+    def __init__(self, win:  Union["Surface", "SurfaceType"], game: 'HasamiShogiGame', player: str,
+                 table_mb: float = 16, time_limit: float = 2.0, node_limit: Union[int, None] = None,
+                 max_depth: int = 32, batch_leaves: bool = False, workers: int = 1, lazy_smp: bool = False,
+                 table_name: Union[str, None] = None, book: Union[str, None] = "opening_book.bin",
+                 tablebase: Union[str, None] = "tablebase_2v2.bin",
+                 quiescence_limit: Union[int, None] = 20000, null_move: bool = True, late_move_reductions: bool = True,
+                 futility: bool = True):
         self._win = win
         self._game = game
         self._player = player
         self._opponent = "BLACK" if self._player == "RED" else "RED"
         self._board = None
         self._turn = 0
-        if self._player == "RED":
-            with open("red_moves.json", 'r') as inFile:
-                self._memorize = json.load(inFile)
-        else:
-            with open("black_moves.json", 'r') as inFile:
-                self._memorize = json.load(inFile)
-        # self._memorize = {}
+        self._nodes = 0
+        self._depth = 0
+        self._time_limit = time_limit           # seconds for each move
+        self._node_limit = node_limit           # nodes for each move, None for no limit
+        self._max_depth = max_depth
+        # nodes of each move that the quiescence search of captures after the leaves can use, 0 turns it off
+        # and None has no limit
+        self._quiescence_limit = quiescence_limit
+        self._quiescence_nodes = 0
+        # score the last ply with evaluate_batch, which can't be used when the leaves go on to quiescence
+        self._batch_leaves = batch_leaves and np is not None and quiescence_limit == 0
+        self._null_move = null_move             # prune when passing still fails high
+        self._late_move_reductions = late_move_reductions      # search quiet moves ordered late a ply shallower
+        self._futility = futility               # skip quiet moves next to the leaves that can't reach alpha
+        # options the worker processes make their own AI with, so they search the same way
+        self._search_options = {'quiescence_limit': quiescence_limit, 'null_move': null_move,
+                                'late_move_reductions': late_move_reductions, 'futility': futility}
+        self._table_mb = table_mb
+        self._workers = workers                 # processes that share the root moves, 1 searches in this one
+        self._lazy_smp = lazy_smp               # workers search the whole position sharing one table instead
+        self._pool: Union[ProcessPoolExecutor, None] = None
+        self._deadline = 0.0
+        self._table = TranspositionTable(table_mb, shared=lazy_smp and workers > 1, name=table_name)
+        self._killers: List[List[Union[Tuple[int, int], None]]] = [[None, None] for _ in range(MAX_PLY)]
+        self._history: List[int] = [0] * (81 * 81)      # cutoffs by quiet moves, indexed by from * 81 + to
+        # evaluations saved by earlier games, looked up when a leaf isn't in the transposition table
+        self._cache = EvaluationCache("red_moves.bin" if self._player == "RED" else "black_moves.bin")
+        self._book = OpeningBook(book) if book is not None else None      # None doesn't use a book
+        self._tablebase = Tablebase(tablebase) if tablebase is not None else None
+        # search of the position after the predicted reply that runs while the opponent thinks
+        self._ponder_thread: Union[threading.Thread, None] = None
+        self._ponder_position: Union[Position, None] = None
+        self._ponder_result: Union[Tuple[int, Tuple[int, int]], None] = None      # depth and best move
+        self._ponder_start = 0.0
+        # table generation, killers and history before pondering, put back when the ponder search is discarded
+        self._ponder_state: Union[Tuple[int, List[List[Union[Tuple[int, int], None]]], List[int]], None] = None
 
     def get_player(self):
         return self._player
 
     def get_mem_moves(self):
-        return self._memorize
+        return self._table.evaluations()
+
+    def save_mem_moves(self) -> None:
+        """Merges the evaluations of this game into the evaluation cache file"""
+        self._cache.merge(self._table.evaluations())
+
+    def get_nodes(self) -> int:
+        """returns how many nodes the last move searched"""
+        return self._nodes
+
+    def get_depth(self) -> int:
+        """returns the depth of the last completed iteration of the last move"""
+        return self._depth
 
     @staticmethod
     def _set_possible_moves(board: 'Board', curr_pieces: List['Square']) -> List[List[Any]]:
@@ -735,38 +1597,24 @@ class AI:
 
     @staticmethod
     def _set_possible_moves_fen(curr_pieces: Tuple[Set[Tuple[int, int]], Set[Tuple[int, int]]]):
+        """Finds all possible moves of the first set of pieces as a dict of piece to list of locations"""
         player, opponent = curr_pieces
-        # print(f'Player: {player}\nOpponent: {opponent}')
+        occupied = 0
+        for piece in player | opponent:
+            occupied |= 1 << Position.to_square(piece)
+
         possible_moves = {}
         for piece in player:
-            rank, file = piece
+            square = Position.to_square(piece)
+            targets = Position.destinations(square, occupied)
             possible_moves[piece] = []
-            for i in range(rank+1, 10):
-                possible = (i, file)
-                if possible not in player and possible not in opponent:
-                    possible_moves[piece].append(possible)
-                else:
-                    break
-            for i in range(rank-1, 0, -1):
-                possible = (i, file)
-                if possible not in player and possible not in opponent:
-                    possible_moves[piece].append(possible)
-                else:
-                    break
-            for j in range(file+1, 10):
-                possible = (rank, j)
-                if possible not in player and possible not in opponent:
-                    possible_moves[piece].append(possible)
-                else:
-                    break
-            for j in range(file-1, 0, -1):
-                possible = (rank, j)
-                if possible not in player and possible not in opponent:
-                    possible_moves[piece].append(possible)
-                else:
-                    break
-
-        # print(f'Possible: {possible_moves}')
+            # keep the order of below, above, right, left and nearest first in each direction
+            for direction, nearest_first in ((1, True), (3, False), (0, True), (2, False)):
+                ray = RAYS[direction][square] & targets
+                while ray:
+                    bit = ray & -ray if nearest_first else 1 << (ray.bit_length() - 1)
+                    possible_moves[piece].append(Position.to_location(bit.bit_length() - 1))
+                    ray ^= bit
         return possible_moves
 
     @staticmethod
@@ -797,26 +1645,332 @@ class AI:
         return player_pieces, opponent_pieces
 
     def pick_move_fen(self, board: str, player: str) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """
+        Picks a move for player on the FEN board, locations are (rank, file) counting from 1.
+        Searches one ply deeper each iteration until the time or node budget runs out and plays the best move
+        of the deepest iteration that finished
+        """
         self._turn += 1
         self._board = board
-        possible_moves = self._set_possible_moves_fen(self.find_curr_pieces(board, player))
-        starts = list(possible_moves.keys())
-        best_start = starts[random.randint(0, len(starts)-1) if len(starts) > 1 else 0]
-        while not possible_moves[best_start]:
-            best_start = starts[random.randint(0, len(starts) - 1) if len(starts) > 1 else 0]
-        best_end = possible_moves[best_start][random.randint(0, len(possible_moves[best_start])-1) if len(possible_moves[best_start]) > 1 else 0]
-        max_score = -1000
+        position = Position.from_fen(board, player)
+        ponder_move = self._finish_ponder(position)
+        if ponder_move is not None:
+            return Position.to_location(ponder_move[0]), Position.to_location(ponder_move[1])
+        self._nodes = 0
+        self._quiescence_nodes = 0
+        self._depth = 0
+        self._deadline = time.time() + self._time_limit
+        moves = position.moves()
+        book_move = self._book_move(position, moves)
+        if book_move is None:
+            book_move = self._tablebase_move(position, moves)
+        if book_move is not None:
+            return Position.to_location(book_move[0]), Position.to_location(book_move[1])
+        best_move = self._search(position, moves, self._workers > 1)
+        return Position.to_location(best_move[0]), Position.to_location(best_move[1])
+
+    def _search(self, position: 'Position', moves: List[Tuple[int, int]], parallel: bool) -> Tuple[int, int]:
+        """
+        Searches the root moves of position until the budget runs out and returns the best move, sets the depth
+        it reached. parallel uses the worker processes
+        """
+        random.shuffle(moves)                   # equal moves are picked at random
+        # the last search usually went through this position after its own move and the reply, so its best move
+        # here is searched first and its killers two plies down are the killers of this root
+        entry = self._table.probe(position.get_hash())
+        if entry is not None and entry[3] in moves:
+            moves.remove(entry[3])
+            moves.insert(0, entry[3])
+        best_move = moves[0]
+        self._table.new_search()
+        self._killers = self._killers[2:] + [[None, None], [None, None]]
+        self._history = [score // 2 for score in self._history]    # older cutoffs count for less
         if self._turn < 1:
-            return best_start, best_end
+            return best_move
 
-        for start in possible_moves.keys():
-            for end in possible_moves[start]:
-                eval = self.minimax_fen(board, [start, end], 2, -1000, 1000, True)
-                if eval > max_score:
-                    max_score = eval
-                    best_start, best_end = start, end
+        if parallel and self._lazy_smp:
+            best_move = self._search_lazy_smp(position, moves)
+        else:
+            # a result the last search left for this position is already most of the way to its depth
+            first_depth, guess = 1, None
+            if entry is not None and entry[1] == TranspositionTable.EXACT and entry[0] > 1:
+                first_depth, guess = min(entry[0], self._max_depth), entry[2]
+            self._depth, _, best_move = self._iterative_deepening(position, moves, first_depth, parallel, guess)
+        return best_move
+
+    def ponder(self, board: str, player: str) -> None:
+        """
+        Starts searching the position after the predicted reply of player on the FEN board on a background
+        thread, so the search is under way while player thinks. The reply is the best move the last search
+        found for it, nothing is pondered without one
+        """
+        self.stop_ponder()
+        position = Position.from_fen(board, player)
+        entry = self._table.probe(position.get_hash())
+        if position.winner() is not None or entry is None or entry[3] not in position.moves():
+            return
+        position.make(entry[3])
+        moves = position.moves()
+        # pick_move_fen answers these without searching
+        if position.winner() is not None or self._book_move(position, moves) or self._tablebase_move(position, moves):
+            return
+        self._ponder_position = position
+        self._ponder_result = None
+        self._ponder_start = time.time()
+        # _update_cutoff changes the killer pairs in place, so the snapshot copies each of them
+        self._ponder_state = (self._table.get_generation(), [killers[:] for killers in self._killers],
+                              self._history[:])
+        self._nodes = 0
+        self._quiescence_nodes = 0
+        self._depth = 0
+        self._deadline = float('inf')           # searches until stop_ponder or the real move arrives
+        self._ponder_thread = threading.Thread(target=self._ponder, args=(position.copy(), moves), daemon=True)
+        self._ponder_thread.start()
+
+    def _ponder(self, position: 'Position', moves: List[Tuple[int, int]]) -> None:
+        """Ponder thread, searches position in this process and keeps the depth and best move it reached"""
+        best_move = self._search(position, moves, False)
+        self._ponder_result = self._depth, best_move
+
+    def stop_ponder(self) -> None:
+        """
+        Stops pondering and waits for the ponder thread to finish, which is at most 1024 nodes. The ponder
+        search is discarded
+        """
+        if self._ponder_thread is not None:
+            self._deadline = 0.0
+            self._ponder_thread.join()
+            self._ponder_thread = None
+            self._discard_ponder()
 
-        return best_start, best_end
+    def _discard_ponder(self) -> None:
+        """
+        Undoes the aging the ponder search did, so the next real search ages the table, killers and history
+        once from the last real search. Its table entries are kept
+        """
+        generation, self._killers, self._history = self._ponder_state
+        self._table.set_generation(generation)
+
+    def _finish_ponder(self, position: 'Position') -> Union[Tuple[int, int], None]:
+        """
+        Ends pondering when the real move arrives. On a ponder hit the search goes on until the move's time,
+        counted from when pondering started, is used up and its best move is returned. Returns None on a miss
+        or when there was no pondering
+        """
+        if self._ponder_thread is None:
+            return None
+        hit = self._ponder_position.key() == position.key() and self._ponder_position.get_side() == position.get_side()
+        self._deadline = self._ponder_start + self._time_limit if hit else 0.0
+        self._ponder_thread.join()
+        self._ponder_thread = None
+        if not hit or self._ponder_result is None or not self._ponder_result[0]:
+            self._discard_ponder()
+            return None
+        return self._ponder_result[1]
+
+    def _tablebase_move(self, position: 'Position', moves: List[Tuple[int, int]]) -> Union[Tuple[int, int], None]:
+        """
+        returns the move that wins fastest or loses slowest when the tablebase has the result of the position,
+        None otherwise
+        """
+        if self._tablebase is None or self._tablebase.probe(position) is None:
+            return None
+        best_move, best_score = None, None
+        for move in moves:
+            child = position.play(move)
+            winner = child.winner()
+            if winner is not None:
+                score = WIN_SCORE if winner != child.get_side() else -WIN_SCORE
+            else:
+                result = self._tablebase.probe(child)
+                if result is None:                      # a draw, or a capture that left the tablebase
+                    score = 0
+                else:
+                    wins, plies = result
+                    score = plies - WIN_SCORE if wins else WIN_SCORE - plies
+            if best_score is None or score > best_score:
+                best_move, best_score = move, score
+        return best_move
+
+    def _book_move(self, position: 'Position', moves: List[Tuple[int, int]]) -> Union[Tuple[int, int], None]:
+        """returns the opening book move of the position or None when it isn't in the book"""
+        if self._book is None:
+            return None
+        entry = self._book.get(position.get_hash())
+        if entry is None or entry[0] not in moves:      # not in the book, or another position with the same hash
+            return None
+        return entry[0]
+
+    def _iterative_deepening(self, position: 'Position', moves: List[Tuple[int, int]], first_depth: int,
+                             parallel_root: bool, guess: Union[int, None] = None) -> Tuple[int, int, Tuple[int, int]]:
+        """
+        Searches the root moves one ply deeper each iteration from first_depth until the budget runs out, the
+        first iteration searches around the guess of its score if there is one.
+        Returns the depth, score and best move of the deepest iteration that finished, depth 0 if none did
+        """
+        completed = 0
+        max_score = -1000 if guess is None else guess
+        best_move = moves[0]
+        search_root = self._search_root_parallel if parallel_root and len(moves) > 1 else self._search_root
+        for depth in range(first_depth, self._max_depth + 1):
+            try:
+                # aspiration window around the last score, searched again with a full window if the score is outside
+                if completed or guess is not None:
+                    alpha, beta = max(max_score - ASPIRATION_WINDOW, -1000), min(max_score + ASPIRATION_WINDOW, 1000)
+                else:
+                    alpha, beta = -1000, 1000
+                score, move = search_root(position, moves, depth, alpha, beta)
+                if (score <= alpha and alpha > -1000) or (score >= beta and beta < 1000):
+                    score, move = search_root(position, moves, depth, -1000, 1000)
+            except SearchTimeout:
+                break
+            completed, max_score, best_move = depth, score, move
+            self._table.store(position.get_hash(), depth, TranspositionTable.EXACT, score, move)
+            # the best move is searched first in the next iteration
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+            if abs(max_score) >= WIN_SCORE:     # the game is decided, searching deeper won't change it
+                break
+        return completed, max_score, best_move
+
+    def _search_lazy_smp(self, position: 'Position', moves: List[Tuple[int, int]]) -> Tuple[int, int]:
+        """
+        Lazy SMP: the worker processes and this one all search the whole position at once, sharing the
+        transposition table so they use each other's results. Odd workers start a ply deeper and every worker
+        orders the root moves differently so they don't all search the same tree. The result of the deepest
+        finished iteration wins, this process first on equal depth, then the workers in order
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self._workers - 1)
+        futures = [self._pool.submit(_search_lazy_smp_worker, position.to_fen(), PLAYERS[position.get_side()],
+                                     self._table.get_name(), self._table_mb, self._table.get_generation(), index,
+                                     self._deadline, self._node_limit, self._max_depth, self._search_options)
+                   for index in range(1, self._workers)]
+        results = [self._iterative_deepening(position, moves, 1, False)]
+        wait(futures)
+        for future in futures:
+            depth, score, move, nodes = future.result()
+            self._nodes += nodes
+            results.append((depth, score, move))
+
+        self._depth, _, best_move = results[0]
+        for depth, _, move in results[1:]:
+            if depth > self._depth:
+                self._depth, best_move = depth, move
+        return best_move
+
+    def search_position(self, board: str, player: str, generation: int, index: int, deadline: float,
+                        node_limit: Union[int, None], max_depth: int) -> Tuple[int, int, Tuple[int, int], int]:
+        """
+        Lazy SMP worker search of the FEN board, index decides its root move order and first depth.
+        Returns the depth, score and best move of its deepest finished iteration and the nodes it used
+        """
+        self._nodes = 0
+        self._quiescence_nodes = 0
+        self._deadline = deadline
+        self._node_limit = node_limit
+        self._max_depth = max_depth
+        self._table.set_generation(generation)
+        self._killers = [[None, None] for _ in range(MAX_PLY)]
+        position = Position.from_fen(board, player)
+        moves = position.moves()
+        random.Random(index).shuffle(moves)
+        return *self._iterative_deepening(position, moves, 1 + index % 2, False), self._nodes
+
+    def _search_root(self, position: 'Position', moves: List[Tuple[int, int]], depth: int, alpha: int,
+                     beta: int) -> Tuple[int, Tuple[int, int]]:
+        """
+        Searches the root moves depth plies deep in the (alpha, beta) window and returns the best score and move.
+        A score outside the window is only a bound
+        """
+        max_score = -1000
+        best_move = moves[0]
+        for index, move in enumerate(moves):
+            undo = position.make(move)
+            eval = self._search_move(position, depth - 1, alpha, beta, 1, index == 0)
+            position.unmake(undo)
+            if eval > max_score:
+                max_score = eval
+                best_move = move
+            alpha = max(alpha, eval)
+            if beta <= alpha:
+                break
+        return max_score, best_move
+
+    def _search_root_parallel(self, position: 'Position', moves: List[Tuple[int, int]], depth: int, alpha: int,
+                              beta: int) -> Tuple[int, Tuple[int, int]]:
+        """
+        Searches the first root move here, then splits the rest between the worker processes searching with
+        the first move's score as alpha. Results are merged in move order so the same move wins every time
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self._workers)
+        undo = position.make(moves[0])
+        first_score = -self.minimax_fen(position, depth - 1, -beta, -alpha, 1)
+        position.unmake(undo)
+        if first_score >= beta:
+            return first_score, moves[0]
+
+        # deal the moves out in turn so every worker gets a similar share of the likely best moves
+        chunks = [moves[index::self._workers] for index in range(1, self._workers + 1) if moves[index::self._workers]]
+        futures = [self._pool.submit(_search_root_moves, position.to_fen(), PLAYERS[position.get_side()], chunk,
+                                     depth, max(alpha, first_score), beta, self._deadline, self._node_limit,
+                                     self._table_mb, self._search_options)
+                   for chunk in chunks]
+        wait(futures)
+        scores = {moves[0]: first_score}
+        for chunk, future in zip(chunks, futures):
+            chunk_scores, nodes = future.result()       # raises SearchTimeout if the worker ran out of time
+            self._nodes += nodes
+            scores.update(zip(chunk, chunk_scores))
+
+        max_score = -1000
+        best_move = moves[0]
+        for move in moves:
+            if scores[move] > max_score:
+                max_score = scores[move]
+                best_move = move
+        return max_score, best_move
+
+    def search_moves(self, board: str, player: str, moves: List[Tuple[int, int]], depth: int, alpha: int, beta: int,
+                     deadline: float, node_limit: Union[int, None]) -> Tuple[List[int], int]:
+        """
+        Searches the given root moves of the FEN board depth plies deep with null windows at alpha, searching
+        again in the (alpha, beta) window the ones that beat it. Returns their scores and the nodes used
+        """
+        self._nodes = 0
+        self._quiescence_nodes = 0
+        self._deadline = deadline
+        self._node_limit = node_limit
+        position = Position.from_fen(board, player)
+        scores = []
+        for move in moves:
+            undo = position.make(move)
+            scores.append(self._search_move(position, depth - 1, alpha, beta, 1, False))
+            position.unmake(undo)
+            alpha = max(alpha, scores[-1])
+        return scores, self._nodes
+
+    def close(self) -> None:
+        """
+        Stops pondering, shuts down the worker processes if any were started and frees a shared transposition
+        table
+        """
+        self.stop_ponder()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self._table.close()
+        self._cache.close()
+        if self._book is not None:
+            self._book.close()
+        if self._tablebase is not None:
+            self._tablebase.close()
+
+    def _check_budget(self) -> None:
+        """Raises SearchTimeout when the time or node budget for the move is used up"""
+        if time.time() >= self._deadline or (self._node_limit is not None and self._nodes >= self._node_limit):
+            raise SearchTimeout
 
     def pick_move(self, board: 'Board') -> Tuple['Square', 'Square']:
         """Picks a move for the AI to play"""
@@ -829,414 +1983,501 @@ class AI:
         best_start, best_end = rand_move[0], (rand_move[1][random.randint(0, len(rand_move[1])-1)] if len(rand_move[1]) > 1 else rand_move[1][0])
         if self._turn < 3:
             return best_start, best_end
+        position = Position(board.get_position().get_pieces(0), board.get_position().get_pieces(1),
+                            PLAYERS.index(self._player))
         for moves in curr_moves:
             start = moves[0]
             for end in moves[1]:
-                eval = self.minimax(board.generate_fen(), [start, end], 1, -1000, 1000, True)
+                eval = self.minimax(position, (start.get_square(), end.get_square()), 1, -1000, 1000, True)
                 if eval > max_score:
                     max_score = eval
                     best_start, best_end = start, end
         return best_start, best_end
 
     def update_board(self, board: str, position: List[Tuple[int, int]], player: str) -> str:
-        if player == "BLACK":
-            replacement = 'B'
-        else:
-            replacement = 'R'
+        """Returns the FEN after player moves from position[0] to position[1] and captures are removed"""
+        curr_position = Position.from_fen(board, player)
+        return curr_position.play((Position.to_square(position[0]), Position.to_square(position[1]))).to_fen()
 
-        rows = board.split('/')
-        from_location, to_location = position
-        from_row = self._expand_row(rows[from_location[0]-1])
-        from_row = self._replace_position(from_row, from_location[1]-1, '.')
-        rows[from_location[0]-1] = self._collapse_row(from_row)
-
-        to_row = self._expand_row(rows[to_location[0]-1])
-        to_row = self._replace_position(to_row, to_location[1]-1, replacement)
-        rows[to_location[0]-1] = self._collapse_row(to_row)
-        self._capture(rows, to_location)
-        return '/'.join(rows)
-
-    def _capture_corners(self, board: List[str], player: str, opponent: str) -> None:
-        # top left
-        if board[0][0] == opponent and board[0][1] == player and board[1][0] == player:
-            board[0] = self._replace_position(board[0], 0, '.')
-
-        # top right
-        if board[0][8] == opponent and board[0][7] == player and board[1][8] == player:
-            board[0] = self._replace_position(board[0], 8, '.')
-
-        # bottom left
-        if board[8][0] == opponent and board[7][0] == player and board[8][1] == player:
-            board[8] = self._replace_position(board[8], 0, '.')
-
-        # bottom right
-        if board[8][8] == opponent and board[7][8] == player and board[8][7] == player:
-            board[8] = self._replace_position(board[8], 8, '.')
-
-    def _capture_pieces(self, board: List[str], captures: List[Tuple[int, int]]) -> None:
-        for piece in captures:
-            board[piece[0]] = self._replace_position(board[piece[0]], piece[1], '.')
-
-    def _capture_directions(self, board: List[str], location: Tuple[int, int], player: str) -> None:
-        rank, file = [pos-1 for pos in location]
-        capture_pieces = []
-        # above
-        if rank > 0:
-            for row in range(rank-1, -1, -1):
-                if board[row][file] == '.':
-                    break
-                if board[row][file] == player:
-                    self._capture_pieces(board, capture_pieces)
-                else:
-                    capture_pieces.append((row, file))
-
-        # below
-        capture_pieces.clear()
-        if rank < 8:
-            for row in range(rank+1, 9):
-                if board[row][file] == '.':
-                    break
-                if board[row][file] == player:
-                    self._capture_pieces(board, capture_pieces)
+    def _order_moves(self, position: 'Position', moves: List[Tuple[int, int]],
+                     best_move: Union[Tuple[int, int], None], ply: int) -> List[Tuple[int, int]]:
+        """
+        Orders moves so cutoffs happen early: the best move from the transposition table, then captures by
+        how many pieces they take, then the killer moves of this ply and then quiet moves by history score
+        """
+        killers = self._killers[ply]
+        history = self._history
+        scored = []
+        for move in moves:
+            if move == best_move:
+                score = 1 << 30
+            else:
+                captures = position.captures(move)
+                if captures:
+                    score = (1 << 25) + captures
+                elif move == killers[0]:
+                    score = 1 << 24
+                elif move == killers[1]:
+                    score = (1 << 24) - 1
                 else:
-                    capture_pieces.append((row, file))
+                    score = min(history[move[0] * 81 + move[1]], (1 << 24) - 2)
+            scored.append((score, move))
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+    def _update_cutoff(self, position: 'Position', move: Tuple[int, int], depth: int, ply: int) -> None:
+        """Remembers a quiet move that caused a beta cutoff as a killer move and in the history scores"""
+        if position.captures(move):
+            return
+        killers = self._killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self._history[move[0] * 81 + move[1]] += depth * depth
+
+    def minimax_fen(self, position: 'Position', depth: int, alpha: int, beta: int, ply: int = 0,
+                    null_move: bool = True) -> int:
+        """
+        Alpha beta search (negamax) of the position, returns the score for the side to move.
+        null_move is False right after a pass so the two sides don't pass in turn
+        """
+        self._nodes += 1
+        if not self._nodes & 1023:
+            self._check_budget()
+        key = position.get_hash()
+        entry = self._table.probe(key)
+        table_move = entry[3] if entry else None
+        # depth 0 entries are static evaluations, which don't replace a quiescence search
+        if entry and entry[0] >= depth and (entry[0] or self._quiescence_limit == 0):
+            _, bound, score, _ = entry
+            if bound == TranspositionTable.EXACT \
+                    or (bound == TranspositionTable.LOWER and score >= beta) \
+                    or (bound == TranspositionTable.UPPER and score <= alpha):
+                return score
+
+        if position.winner() is not None or (depth == 0 and self._quiescence_limit == 0):
+            return self._evaluate(position)
+        if depth == 0:
+            return self._quiescence(position, alpha, beta)
+
+        if depth == 1 and self._batch_leaves:
+            return self._search_frontier(position)
+
+        null_window = beta - alpha == 1             # not on the principal variation
+        static_eval = position.evaluate(position.get_side()) if null_window else 0
+        # null-move pruning: if passing and searching shallower still fails high, moving would too
+        if self._null_move and null_move and null_window and depth > NULL_MOVE_REDUCTION and static_eval >= beta:
+            position.pass_turn()
+            eval = -self.minimax_fen(position, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1, ply + 1, False)
+            position.pass_turn()
+            if eval >= beta:
+                return eval
+        # futility pruning: one ply from the leaves quiet moves can't raise a score this far below alpha
+        futile = self._futility and null_window and depth == 1 and static_eval + FUTILITY_MARGIN <= alpha
+
+        original_alpha = alpha
+        max_eval = -WIN_SCORE
+        best_move = None
+        killers = self._killers[min(ply, MAX_PLY - 1)]
+        for index, move in enumerate(self._order_moves(position, position.moves(), table_move, min(ply, MAX_PLY - 1))):
+            quiet = index > 0 and move not in killers and not position.captures(move)
+            if futile and quiet:
+                if static_eval + FUTILITY_MARGIN > max_eval:
+                    max_eval = static_eval + FUTILITY_MARGIN
+                continue
+            undo = position.make(move)
+            if self._late_move_reductions and quiet and index >= 3 and depth >= 3:
+                # late move reduction: search a ply shallower and only search fully if it beats alpha
+                eval = -self.minimax_fen(position, depth - 2, -alpha - 1, -alpha, ply + 1)
+                if eval > alpha:
+                    eval = self._search_move(position, depth - 1, alpha, beta, ply + 1, False)
+            else:
+                eval = self._search_move(position, depth - 1, alpha, beta, ply + 1, index == 0)
+            position.unmake(undo)
+            if eval > max_eval or best_move is None:
+                max_eval = eval
+                best_move = move
+            alpha = max(alpha, eval)
+            if beta <= alpha:
+                self._update_cutoff(position, move, depth, min(ply, MAX_PLY - 1))
+                break
 
-        # left
-        capture_pieces.clear()
-        if file > 0:
-            for col in range(file-1, -1, -1):
-                if board[rank][col] == '.':
-                    break
-                if board[rank][col] == player:
-                    self._capture_pieces(board, capture_pieces)
-                else:
-                    capture_pieces.append((rank, col))
-
-                # left
-                capture_pieces.clear()
-                if file < 8:
-                    for col in range(file + 1, 9):
-                        if board[rank][col] == '.':
-                            break
-                        if board[rank][col] == player:
-                            self._capture_pieces(board, capture_pieces)
-                        else:
-                            capture_pieces.append((rank, col))
-
-    def _capture(self, board: List[str], location: Tuple[int, int]) -> None:
-        for i in range(len(board)):
-            board[i] = self._expand_row(board[i])
-
-        player = board[location[0]-1][location[1]-1]
-        if player == 'B':
-            opponent = 'R'
+        if max_eval <= original_alpha:
+            bound = TranspositionTable.UPPER
+        elif max_eval >= beta:
+            bound = TranspositionTable.LOWER
         else:
-            opponent = 'B'
-
-        self._capture_corners(board, player, opponent)
-        self._capture_directions(board, location, player)
-
-        for i in range(len(board)):
-            board[i] = self._collapse_row(board[i])
-
-    @staticmethod
-    def _won(board: str) -> bool:
-        red = board.count('R')
-        black = board.count('B')
-        if red <= 1 or black <= 1:
-            return True
-        return False
+            bound = TranspositionTable.EXACT
+        self._table.store(key, depth, bound, max_eval, best_move)
+        return max_eval
 
-    @staticmethod
-    def _surround_score(player: str, opponent: str, board: List[str]) -> int:
-        above = 0
-        for i in range(9):
-            if opponent in board[i]:
-                break
-            above += board[i].count(player)
-        below = 0
-        for i in range(8, -1, -1):
-            if opponent in board[i]:
-                break
-            below += board[i].count(player)
-
-        left = 0
-        for col in range(9):
-            flag = False
-            for row in range(9):
-                count = 0
-                if board[row][col] == opponent:
-                    flag = True
-                    break
-                if board[row][col] == player:
-                    count += 1
-            if flag:
-                break
-            left += count
-
-        right = 0
-        for col in range(8, -1, -1):
-            flag = False
-            for row in range(9):
-                count = 0
-                if board[row][col] == opponent:
-                    flag = True
-                    break
-                if board[row][col] == player:
-                    count += 1
-            if flag:
-                break
-            right += count
-
-        return min(above, below) * 2 + min(left, right) * 2
+    def _search_move(self, position: 'Position', depth: int, alpha: int, beta: int, ply: int, first: bool) -> int:
+        """
+        Principal variation search of the position after a move, returns the score for the side that moved.
+        The first move gets the whole window, later moves a null window that only tells if they beat alpha,
+        and the ones that do are searched again with the whole window
+        """
+        if first:
+            return -self.minimax_fen(position, depth, -beta, -alpha, ply)
+        eval = -self.minimax_fen(position, depth, -alpha - 1, -alpha, ply)
+        if alpha < eval < beta:
+            eval = -self.minimax_fen(position, depth, -beta, -alpha, ply)
+        return eval
+
+    def _evaluate(self, position: 'Position') -> int:
+        """Returns the static evaluation for the side to move from the evaluation cache or evaluate"""
+        key = position.get_hash()
+        score = self._cache.get(key)
+        if score is None:
+            score = position.evaluate(position.get_side())
+        self._table.store(key, 0, TranspositionTable.EXACT, score, None)
+        return score
 
-    def _open_score(self, player: str, opponent: str, location: Tuple[int, int], board: List[str]) -> int:
-        score = 0
-        # above
-        good_pieces = 0
-        bad_pieces = 0
-        open_flag = False
-        for row in range(location[0]-1, -1, -1):
-            if board[row][location[1]-1] == '.':
-                score -= bad_pieces
-                open_flag = True
-                break
-            if board[row][location[1]-1] == player:
-                bad_pieces += 1
-            else:
-                good_pieces += 1
-
-        if not open_flag:
-            score += good_pieces
-
-        # below
-        good_pieces = 0
-        bad_pieces = 0
-        open_flag = False
-        for row in range(location[0]+1, 9):
-            if board[row][location[1] - 1] == '.':
-                score -= bad_pieces
-                open_flag = True
-                break
-            if board[row][location[1] - 1] == player:
-                bad_pieces += 1
-            else:
-                good_pieces += 1
-
-        if not open_flag:
-            score += good_pieces
-
-        # left
-        good_pieces = 0
-        bad_pieces = 0
-        open_flag = False
-        for col in range(location[1]-1, -1, -1):
-            if board[location[0]-1][col] == '.':
-                score -= bad_pieces
-                open_flag = True
-                break
-            if board[location[0]-1][col] == player:
-                bad_pieces += 1
-            else:
-                good_pieces += 1
-
-        if not open_flag:
-            score += good_pieces
-
-        # right
-        good_pieces = 0
-        bad_pieces = 0
-        open_flag = False
-        for col in range(location[1] + 1, 9):
-            if board[location[0] - 1][col] == '.':
-                score -= bad_pieces
-                open_flag = True
+    def _quiescence(self, position: 'Position', alpha: int, beta: int) -> int:
+        """
+        Searches only captures after a leaf until there are none, so a leaf isn't scored halfway through an
+        exchange. The side to move can stand pat on the static evaluation instead of capturing. Once the
+        quiescence nodes of the move are used up the leaves are scored as they are
+        """
+        score = self._evaluate(position)
+        if score >= beta or position.winner() is not None:
+            return score
+        if self._quiescence_limit is not None and self._quiescence_nodes >= self._quiescence_limit:
+            return score
+        alpha = max(alpha, score)
+        for move in position.capture_moves():
+            self._nodes += 1
+            self._quiescence_nodes += 1
+            if not self._nodes & 1023:
+                self._check_budget()
+            undo = position.make(move)
+            eval = -self._quiescence(position, -beta, -alpha)
+            position.unmake(undo)
+            score = max(score, eval)
+            alpha = max(alpha, eval)
+            if beta <= alpha:
                 break
-            if board[location[0] - 1][col] == player:
-                bad_pieces += 1
-            else:
-                good_pieces += 1
-
-        if not open_flag:
-            score += good_pieces
-
         return score
 
-    def _evaluate(self, player: str, new_board: str, old_board: str) -> int:
-        if player == "RED":
-            player = 'R'
-            opponent = 'B'
+    def _search_frontier(self, position: 'Position') -> int:
+        """Searches a node one ply above the leaves by scoring all of its children together with evaluate_batch"""
+        moves = position.moves()
+        if not moves:
+            return -WIN_SCORE
+        black, red = [], []
+        for move in moves:
+            undo = position.make(move)
+            black.append(position.get_pieces(0))
+            red.append(position.get_pieces(1))
+            position.unmake(undo)
+        self._nodes += len(moves)
+        self._check_budget()
+
+        scores = evaluate_batch(boards_from_bitboards(black, red), PLAYERS[position.get_side()])
+        best = int(scores.argmax())
+        max_eval = int(scores[best])
+        # every child was scored so the result is exact whatever the window was
+        self._table.store(position.get_hash(), 1, TranspositionTable.EXACT, max_eval, moves[best])
+        return max_eval
+
+    def minimax(self, position: 'Position', move: Tuple[int, int], depth: int, alpha: int, beta: int,
+                maximizing_player: bool) -> int:
+        """
+        Scores move played by the side to move in position, the maximizing player is the opponent that moves next.
+        The position is left unchanged
+        """
+        undo = position.make(move)
+        if depth == 0 or position.winner() is not None:
+            score = Board.evaluate_position(position, self._player, self._board.get_position())
+        elif maximizing_player:
+            score = -1000
+            for curr_move in position.moves():
+                score = max(score, self.minimax(position, curr_move, depth-1, alpha, beta, False))
+                alpha = max(alpha, score)
+                if beta <= alpha:
+                    break
         else:
-            player = 'B'
-            opponent = 'R'
-        new_red = new_board.count('R')
-        new_black = new_board.count('B')
-        old_red = old_board.count('R')
-        old_black = old_board.count('B')
+            score = 1000
+            for curr_move in position.moves():
+                score = min(score, self.minimax(position, curr_move, depth - 1, alpha, beta, True))
+                beta = min(beta, score)
+                if beta <= alpha:
+                    break
+        position.unmake(undo)
+        return score
 
-        # expand the board
-        new_board = new_board.split('/')
-        for i in range(len(new_board)):
-            new_board[i] = self._expand_row(new_board[i])
 
-        pieces_score = 0
-        if player == 'R':
-            if new_black <= 1:
-                return 1000
-            if new_red <= 1:
-                return -1000
-            pieces_score += (old_black - new_black) * 10
-            pieces_score -= (old_red - new_red) * 10
-        else:
-            if new_black <= 1:
-                return -1000
-            if new_red <= 1:
-                return 1000
-            pieces_score -= (old_black - new_black) * 10
-            pieces_score += (old_red - new_red) * 10
+# the AI of each player in a worker process, kept so its transposition table lasts between tasks
+_worker_ais: Dict[Any, AI] = {}
+
+
+def _search_root_moves(board: str, player: str, moves: List[Tuple[int, int]], depth: int, alpha: int, beta: int,
+                       deadline: float, node_limit: Union[int, None], table_mb: float,
+                       options: Dict[str, Any]) -> Tuple[List[int], int]:
+    """Process pool task for AI._search_root_parallel, searches root moves with the worker's own AI"""
+    key = (player, *sorted(options.items()))
+    if key not in _worker_ais:
+        _worker_ais[key] = AI(None, None, player, table_mb=table_mb, **options)
+    return _worker_ais[key].search_moves(board, player, moves, depth, alpha, beta, deadline, node_limit)
+
+
+def _search_lazy_smp_worker(board: str, player: str, table_name: str, table_mb: float, generation: int, index: int,
+                            deadline: float, node_limit: Union[int, None], max_depth: int,
+                            options: Dict[str, Any]) -> Tuple[int, int, Tuple[int, int], int]:
+    """Process pool task for AI._search_lazy_smp, searches with an AI attached to the shared table"""
+    key = (player, table_name, *sorted(options.items()))
+    if key not in _worker_ais:
+        _worker_ais[key] = AI(None, None, player, table_mb=table_mb, table_name=table_name, **options)
+    return _worker_ais[key].search_position(board, player, generation, index, deadline, node_limit, max_depth)
+
+
+class MCTSNode:
+    """A position in the Monte Carlo search tree, reached by move from its parent"""
+    __slots__ = ('_move', '_mover', '_parent', '_children', '_untried', '_visits', '_wins', '_winner')
+
+    def __init__(self, position: 'Position', move: Union[Tuple[int, int], None] = None,
+                 parent: Union['MCTSNode', None] = None):
+        self._move = move
+        self._mover = position.get_side() ^ 1   # the side that played move
+        self._parent = parent
+        self._children: List['MCTSNode'] = []
+        self._winner = position.winner()
+        # moves that have no child yet, a won position has none
+        self._untried = position.moves() if self._winner is None else []
+        random.shuffle(self._untried)
+        self._visits = 0
+        self._wins = 0.0            # playouts won by the side that played move, a draw counts as half
+
+    def get_move(self) -> Union[Tuple[int, int], None]:
+        return self._move
+
+    def get_visits(self) -> int:
+        return self._visits
+
+    def get_children(self) -> List['MCTSNode']:
+        return self._children
+
+    def select(self, exploration: float) -> 'MCTSNode':
+        """returns the child with the highest upper confidence bound (UCT)"""
+        log_visits = math.log(self._visits)
+        best_child, best_bound = None, -1.0
+        for child in self._children:
+            bound = child._wins / child._visits + exploration * math.sqrt(log_visits / child._visits)
+            if bound > best_bound:
+                best_child, best_bound = child, bound
+        return best_child
+
+    def expand(self, position: 'Position') -> 'MCTSNode':
+        """Plays one of the untried moves on position and returns the child it adds"""
+        move = self._untried.pop()
+        position.make(move)
+        child = MCTSNode(position, move, self)
+        self._children.append(child)
+        return child
+
+
+def _playout(pieces: List[int], side: int, turns: int, guided: bool) -> Union[int, None]:
+    """
+    Plays random moves from the bitboards of both sides with side to move, for at most turns moves, and returns
+    the side that won. When no side won the one with more pieces wins, None for a draw. guided plays a capture
+    when one of two random moves makes it. Works on the bitboards directly, pieces is changed
+    """
+    randrange = random.randrange
+    for _ in range(turns):
+        own = pieces[side]
+        occupied = pieces[0] | pieces[1]
+        squares = []
+        while own:
+            bit = own & -own
+            squares.append(bit.bit_length() - 1)
+            own ^= bit
+        move = None
+        for _ in range(2 if guided else 1):
+            # a random piece that can move, then a random square it can slide to
+            start = randrange(len(squares))
+            for offset in range(len(squares)):
+                square = squares[(start + offset) % len(squares)]
+                targets = Position.destinations(square, occupied)
+                if targets:
+                    break
+            else:
+                return side ^ 1                 # no piece can move, counted as a loss
+            for _ in range(randrange(targets.bit_count())):
+                targets &= targets - 1
+            move = square, (targets & -targets).bit_length() - 1
+            if guided and ADJACENT[move[1]] & pieces[side ^ 1]:
+                after = pieces[:]
+                after[side] ^= 1 << move[0] | 1 << move[1]
+                if Position.capture(after, side, move[1])[side ^ 1]:
+                    break
+        from_square, to_square = move
+        pieces[side] ^= 1 << from_square | 1 << to_square
+        if ADJACENT[to_square] & pieces[side ^ 1]:     # sandwich and corner captures both need one next to it
+            Position.capture(pieces, side, to_square)
+            if pieces[side ^ 1].bit_count() <= 1:
+                return side
+            if pieces[side].bit_count() <= 1:
+                return side ^ 1
+        side ^= 1
+    black, red = pieces[0].bit_count(), pieces[1].bit_count()
+    return None if black == red else (0 if black > red else 1)
+
+
+class MCTS:
+    """
+    Monte Carlo tree search (UCT) AI. Plays random playouts from the position for the time budget and picks
+    the move that was visited most. Has the same interface as AI so either can play a side
+    """
+    def __init__(self, win: Union["Surface", "SurfaceType", None], game: Union['HasamiShogiGame', None],
+                 player: str, time_limit: float = 2.0, playout_limit: Union[int, None] = None,
+                 exploration: float = 1.4, playout_turns: int = 8, guided: bool = False, batch: int = 0,
+                 reuse_tree: bool = True):
+        self._win = win
+        self._game = game
+        self._player = player
+        self._time_limit = time_limit           # seconds for each move
+        self._playout_limit = playout_limit     # playouts for each move, None for no limit
+        self._exploration = exploration         # weight of the UCT exploration term
+        self._playout_turns = playout_turns     # moves a playout goes before the side with more pieces wins
+        self._guided = guided                   # playouts prefer captures
+        # playouts each new node runs together with playout_batch, 0 runs one with _playout
+        self._batch = batch if np is not None else 0
+        self._playouts = 0
+        # the tree of the last move and its root position, the next move starts from the node of the position it
+        # is asked about when the tree has it
+        self._reuse_tree = reuse_tree
+        self._root: Union[MCTSNode, None] = None
+        self._root_position: Union[Position, None] = None
+        self._deadline = 0.0
+        self._ponder_thread: Union[threading.Thread, None] = None      # grows the tree while the opponent thinks
 
-        surround_score = 0
-        surround_score += self._surround_score(player, opponent, new_board)
-        surround_score -= self._surround_score(opponent, player, new_board)
+    def get_player(self):
+        return self._player
 
-        open_score = 0
-        for rank in range(len(new_board)):
-            for file in range(len(new_board[rank])):
-                if new_board[rank][file] == player:
-                    open_score += self._open_score(player, opponent, (rank, file), new_board)
-                if new_board[rank][file] == opponent:
-                    open_score -= self._open_score(opponent, player, (rank, file), new_board)
+    def get_nodes(self) -> int:
+        """returns how many playouts the last move ran"""
+        return self._playouts
 
-        return pieces_score + surround_score + (open_score // (old_red if player == 'R' else old_black))
+    def get_depth(self) -> int:
+        """MCTS has no search depth, kept so it can stand in for AI"""
+        return 0
 
-    @staticmethod
-    def _replace_position(row: str, position: int, replacement: str):
-        return row[:position] + replacement + row[position+1:]
+    def save_mem_moves(self) -> None:
+        """MCTS keeps no evaluations between games, kept so it can stand in for AI"""
 
-    @staticmethod
-    def _expand_row(row: str) -> str:
-        output = ''
-        for char in row:
-            if char.isalpha():
-                output += char
-            else:
-                for _ in range(int(char)):
-                    output += '.'
-        return output
+    def close(self) -> None:
+        """Stops pondering, MCTS holds no files or processes"""
+        self.stop_ponder()
 
-    @staticmethod
-    def _collapse_row(row: str) -> str:
-        output = ''
-        location = 0
-        while location < len(row):
-            if row[location].isalpha():
-                output += row[location]
+    def pick_move_fen(self, board: str, player: str) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """
+        Picks a move for player on the FEN board, locations are (rank, file) counting from 1.
+        Runs playouts until the time or playout budget runs out and plays the most visited move
+        """
+        self.stop_ponder()
+        root_position = Position.from_fen(board, player)
+        root = self._find_root(root_position) if self._reuse_tree else None
+        if root is None:
+            root = MCTSNode(root_position)
+        self._deadline = time.time() + self._time_limit
+        self._playouts = 0
+        self._grow(root, root_position, self._playout_limit)
+        self._root, self._root_position = root, root_position
+        best = max(root.get_children(), key=lambda child: child.get_visits())
+        return Position.to_location(best.get_move()[0]), Position.to_location(best.get_move()[1])
+
+    def ponder(self, board: str, player: str) -> None:
+        """
+        Grows the tree of the FEN board with player to move on a background thread while player thinks.
+        MCTS doesn't predict one reply, the next pick_move_fen starts from the node of the reply that was played
+        """
+        self.stop_ponder()
+        if not self._reuse_tree:
+            return
+        position = Position.from_fen(board, player)
+        root = self._find_root(position) or MCTSNode(position)
+        if root._winner is not None:
+            return
+        self._root, self._root_position = root, position
+        self._deadline = float('inf')           # grows until stop_ponder or the real move arrives
+        self._ponder_thread = threading.Thread(target=self._grow, args=(root, position, None), daemon=True)
+        self._ponder_thread.start()
+
+    def stop_ponder(self) -> None:
+        """Stops pondering and waits for the ponder thread to finish its playout"""
+        if self._ponder_thread is not None:
+            self._deadline = 0.0
+            self._ponder_thread.join()
+            self._ponder_thread = None
+
+    def _grow(self, root: MCTSNode, root_position: 'Position', playout_limit: Union[int, None]) -> None:
+        """Runs playouts from root until the deadline or the playout limit, the root always gets a child"""
+        while not root.get_children() or (time.time() < self._deadline and (playout_limit is None
+                                                                           or self._playouts < playout_limit)):
+            node = root
+            position = root_position.copy()
+            # walk down the fully expanded nodes, then add one child
+            while not node._untried and node._children:
+                node = node.select(self._exploration)
+                position.make(node._move)
+            if node._untried:
+                node = node.expand(position)
+            playouts = max(self._batch, 1)
+            if node._winner is not None:
+                wins = [0, 0]
+                wins[node._winner] = playouts
+                draws = 0
+            elif self._batch:
+                boards = boards_from_bitboards([position.get_pieces(0)], [position.get_pieces(1)])
+                winners = playout_batch(np.repeat(boards, playouts, axis=0), position.get_side(),
+                                        self._playout_turns)
+                wins = [int((winners == 0).sum()), int((winners == 1).sum())]
+                draws = playouts - wins[0] - wins[1]
             else:
-                dot = 1
-                while location + 1 != len(row) and row[location + 1] == '.':
-                    dot += 1
-                    location += 1
-                output += str(dot)
-            location += 1
-        return output
-
-    def minimax_fen(self, board: str, position: List[Tuple[int, int]], depth: int, alpha: int, beta: int, maximizing_player: bool) -> int:
-        if self._player == "RED":
-            player = "RED"
-            opponent = "BLACK"
-        else:
-            player = "BLACK"
-            opponent = "RED"
-
-        curr_board = self.update_board(board, position, player)
-
-        if depth == 0 or self._won(curr_board):
-            self._memorize[curr_board] = self._memorize.get(curr_board, self._evaluate(self._player, curr_board, self._board))
-            return self._memorize[curr_board] + random.randint(-5, 5)
-
-        if maximizing_player:
-            possible_moves = self._set_possible_moves_fen(self.find_curr_pieces(curr_board, opponent))
-            maxEval = -1000
-            flag = False
-            for start in possible_moves.keys():
-                for end in possible_moves[start]:
-                    eval = self.minimax_fen(curr_board, [start, end], depth-1, alpha, beta, False)
-                    maxEval = max(maxEval, eval)
-                    alpha = max(alpha, eval)
-                    if beta <= alpha:
-                        flag = True
-                        break
-                if flag:
-                    break
-            return maxEval
-        else:
-            possible_moves = self._set_possible_moves_fen(self.find_curr_pieces(curr_board, player))
-            minEval = 1000
-            flag = False
-            for start in possible_moves.keys():
-                for end in possible_moves[start]:
-                    eval = self.minimax_fen(curr_board, [start, end], depth - 1, alpha, beta, True)
-                    minEval = min(minEval, eval)
-                    beta = min(beta, eval)
-                    if beta <= alpha:
-                        flag = True
-                        break
-                if flag:
-                    break
-            return minEval
-
-    def minimax(self, board: str, position: List['Square'], depth: int, alpha: int, beta: int, maximizing_player: bool) -> int:
-        """TODO"""
-        curr_board = Board(self._win, board)
-        from_rank, from_file = position[0].get_location()
-        to_rank, to_file = position[1].get_location()
-        curr_board.ai_move(curr_board.occupant(from_rank-1, from_file-1), curr_board.occupant(to_rank-1, to_file-1))
-        curr_board.capture_pieces(curr_board.occupant(to_rank-1, to_file-1))
-
-        if depth == 0 or curr_board.won():
-            return curr_board.evaluate(self._player, self._board)
-
-        if maximizing_player:
-            curr_pieces = curr_board.get_player_locations(self._opponent)
-            curr_moves = self._set_possible_moves(curr_board, curr_pieces)
-            maxEval = -1000
-            flag = False
-            for moves in curr_moves:
-                start: 'Square' = moves[0]
-                for end in moves[1]:
-                    # print(f'\tMaximizing from: {start.get_location()}\tto: {end.get_location()}')
-                    eval = self.minimax(curr_board.generate_fen(), [start, end], depth-1, alpha, beta, False)
-                    maxEval = max(maxEval, eval)
-                    alpha = max(alpha, eval)
-                    if beta <= alpha:
-                        flag = True
-                        break
-                if flag:
-                    break
-            return maxEval
-        else:
-            curr_pieces = curr_board.get_player_locations(self._player)
-            curr_moves = self._set_possible_moves(curr_board, curr_pieces)
-            minEval = 1000
-            flag = False
-            for moves in curr_moves:
-                start: 'Square' = moves[0]
-                for end in moves[1]:
-                    # print(f'\tMinimizing from: {start.get_location()}\tto: {end.get_location()}')
-                    eval = self.minimax(curr_board.generate_fen(), [start, end],
-                                        depth - 1, alpha, beta, True)
-                    minEval = min(minEval, eval)
-                    beta = min(beta, eval)
-                    if beta <= alpha:
-                        flag = True
-                        break
-                if flag:
-                    break
-            return minEval
+                winner = _playout([position.get_pieces(0), position.get_pieces(1)], position.get_side(),
+                                  self._playout_turns, self._guided)
+                wins = [int(winner == 0), int(winner == 1)]
+                draws = int(winner is None)
+            self._playouts += playouts
+            # each node counts the results for the side that moved into it
+            while node is not None:
+                node._visits += playouts
+                node._wins += wins[node._mover] + draws / 2
+                node = node._parent
+
+    def _find_root(self, position: 'Position') -> Union[MCTSNode, None]:
+        """
+        returns the node of the last tree for position, looking at the last root and the positions one and two
+        moves after it, and detaches it from the tree. None when the tree doesn't have it
+        """
+        if self._root is None:
+            return None
+        nodes = [(self._root, self._root_position)]
+        for _ in range(3):
+            next_nodes = []
+            for node, node_position in nodes:
+                if node_position.key() == position.key() and node_position.get_side() == position.get_side():
+                    node._parent = None
+                    return node
+                # only follow moves from a square the mover has left to a square it has a piece on
+                mover = node_position.get_side()
+                left = node_position.get_pieces(mover) & ~position.get_pieces(mover)
+                arrived = position.get_pieces(mover) & ~node_position.get_pieces(mover)
+                for child in node.get_children():
+                    from_square, to_square = child.get_move()
+                    if left >> from_square & 1 and arrived >> to_square & 1:
+                        next_nodes.append((child, node_position.play(child.get_move())))
+            nodes = next_nodes
+        return None
+
+
+# the engines that can play a side, by the name play_game and terminal take
+ENGINES: Dict[str, Any] = {"minimax": AI, "mcts": MCTS}
 
 
 def top_bar(win: Union["Surface", "SurfaceType"], game: HasamiShogiGame) -> None:
     """Draws the top bar onto the screen"""
+    import pygame as pg
     font = pg.font.SysFont(None, 60)
     color = (0, 0, 0)
     # Display the current player at the top of the board
@@ -1262,7 +2503,11 @@ def top_bar(win: Union["Surface", "SurfaceType"], game: HasamiShogiGame) -> None
 
 def winner(win: Union["Surface", "SurfaceType"], game: HasamiShogiGame) -> None:
     """Displays winner splash screen"""
-    paper_wall = pg.transform.scale(pg.image.load('Images/paper_wall.webp'), (win.get_width(), win.get_height()))
+    import pygame as pg
+    if 'PAPER_WALL' not in _images:
+        _images['PAPER_WALL'] = pg.transform.scale(pg.image.load('Images/paper_wall.webp'),
+                                                   (win.get_width(), win.get_height()))
+    paper_wall = _images['PAPER_WALL']
     win.blit(paper_wall, (0, 0))
     font = pg.font.SysFont(None, 100)
     color = (0, 0, 0)
@@ -1306,9 +2551,8 @@ def window_update(win: Union["Surface", "SurfaceType"], game: HasamiShogiGame) -
     win.fill((255, 255, 255))
     # Display each square and board
     if game.get_game_state() == "UNFINISHED":
-        for rank in game.get_board().get_board():
-            for square in rank:
-                square.draw(win)
+        for square in game.get_board().get_board():
+            square.draw(win)
 
         game.get_board().draw(win)
         top_bar(win, game)
@@ -1319,6 +2563,7 @@ def window_update(win: Union["Surface", "SurfaceType"], game: HasamiShogiGame) -
 
 def title_update(win: Union["Surface", "SurfaceType"], selection: int = 0) -> None:
     """Updates the title screen window"""
+    import pygame as pg
     win.fill((255, 255, 255))
     font = pg.font.SysFont(None, 100)
     color = (0, 0, 0)
@@ -1390,8 +2635,9 @@ def title_update(win: Union["Surface", "SurfaceType"], selection: int = 0) -> No
     )
 
 
-def title_screen() -> None:
-    """Holds logic for the title screen interaction"""
+def title_screen(red_engine: str = "minimax", black_engine: str = "minimax") -> None:
+    """Holds logic for the title screen interaction, the engines are passed on to play_game"""
+    import pygame as pg
 
     # create pygame window
     pg.init()
@@ -1405,7 +2651,7 @@ def title_screen() -> None:
             if event.type == pg.QUIT:
                 sys.exit()
             elif pg.key.get_pressed()[pg.K_SPACE]:          # space is pressed, so play game
-                play_game(win, selection)
+                play_game(win, selection, red_engine, black_engine)
             elif pg.key.get_pressed()[pg.K_DOWN]:           # Scrolls down, but wraps around
                 selection = (selection + 1) % 3
             elif pg.key.get_pressed()[pg.K_UP]:             # Scrolls up, but wraps around
@@ -1414,15 +2660,16 @@ def title_screen() -> None:
         pg.display.update()
 
 
-def play_game(win, selection) -> None:
-    """plays the Hasami Shogi Game"""
+def play_game(win, selection, red_engine: str = "minimax", black_engine: str = "minimax") -> None:
+    """plays the Hasami Shogi Game, the AI players use the engines of ENGINES named by red_engine and black_engine"""
+    import pygame as pg
     random.seed()
     game = HasamiShogiGame(win)
     from_piece = None
     cycles = 0
     if selection == 0 or selection == 2:      # if 1 player was selected
-        ai_red = AI(win, game, "RED")
-        ai_black = AI(win, game, "BLACK")
+        ai_red = ENGINES[red_engine](win, game, "RED")
+        ai_black = ENGINES[black_engine](win, game, "BLACK")
     while True:
 
         for event in pg.event.get():
@@ -1432,6 +2679,8 @@ def play_game(win, selection) -> None:
             # if game is finished and player chose Y (play again)
             elif pg.key.get_pressed()[pg.K_y] and game.get_game_state() != 'UNFINISHED':
                 game = HasamiShogiGame(win)
+                if selection == 0:
+                    ai_red.stop_ponder()
 
             # Lets players click on pieces to move. Selection 1 means 2 players are playing
             if (game.get_active_player() == 'BLACK' and selection == 0) or selection == 1:
@@ -1477,6 +2726,9 @@ def play_game(win, selection) -> None:
                     print(
                         f'{game.get_active_player().lower().capitalize()}\'s selection: {from_rank + from_file} -> {to_rank + to_file}')
                     game.ai_make_move_fen(from_location, to_location)
+                    # search the predicted reply on a thread while the player thinks
+                    if selection == 0 and game.get_game_state() == 'UNFINISHED':
+                        ai_red.ponder(game.get_board().generate_fen(), game.get_active_player())
                     # print(game.get_board().count_pieces())
                     print(game.get_board().generate_fen())
                     # game.get_board().print_board()
@@ -1507,18 +2759,236 @@ def play_game(win, selection) -> None:
         pg.display.update()
 
 
-def terminal():
-    pg.init()
-    width = 750
-    height = 820
+# positions from the start, the middle and the end of games, with the player to move
+BENCHMARK_POSITIONS: List[Tuple[str, str]] = [
+    ('RRRRRRRRR/9/9/9/9/9/9/9/BBBBBBBBB', 'BLACK'),
+    ('R1RR1RR1R/1R7/4R4/9/2B6/9/1B2R4/9/B1BB1BB1B', 'RED'),
+    ('2R3R2/1R3B3/3B5/9/4R4/2B3B2/9/5R3/B7B', 'BLACK'),
+]
+
+
+# the selective search options each alone, after searching with none of them and before all of them
+PRUNING_SETTINGS: List[Dict[str, Any]] = [
+    {'null_move': False, 'late_move_reductions': False, 'futility': False},
+    {'null_move': True, 'late_move_reductions': False, 'futility': False},
+    {'null_move': False, 'late_move_reductions': True, 'futility': False},
+    {'null_move': False, 'late_move_reductions': False, 'futility': True},
+    {'null_move': True, 'late_move_reductions': True, 'futility': True},
+]
+
+
+def benchmark(depth: int = 3, settings: Union[List[Dict[str, Any]], None] = None) -> None:
+    """
+    Searches the benchmark positions to a fixed depth with each setting of AI options and prints the time,
+    nodes and nodes/sec of each, and its speedup over the first setting
+    """
+    if settings is None:
+        settings = [{'workers': 1}, {'workers': os.cpu_count() or 1}]
+    base_time = None
+    for options in settings:
+        nodes = 0
+        begin = time.time()
+        for board, player in BENCHMARK_POSITIONS:
+            ai = AI(None, None, player, time_limit=float('inf'), max_depth=depth, book=None, tablebase=None,
+                    **options)
+            ai.pick_move_fen(board, player)
+            nodes += ai.get_nodes()
+            ai.close()
+        total = time.time() - begin
+        base_time = base_time or total
+        print(f'{options}, depth: {depth}, time: {round(total, 2)}s, nodes: {nodes}, '
+              f'nodes/sec: {int(nodes / total)}, speedup: {round(base_time / total, 2)}x')
+
+
+def benchmark_playouts(playouts: int = 4096, turns: int = 8) -> None:
+    """Runs random playouts from the benchmark positions with _playout and playout_batch and prints playouts/sec"""
+    for board, player in BENCHMARK_POSITIONS:
+        position = Position.from_fen(board, player)
+        begin = time.time()
+        for _ in range(playouts):
+            _playout([position.get_pieces(0), position.get_pieces(1)], position.get_side(), turns, False)
+        single = playouts / (time.time() - begin)
+        begin = time.time()
+        boards = boards_from_bitboards([position.get_pieces(0)], [position.get_pieces(1)])
+        playout_batch(np.repeat(boards, playouts, axis=0), position.get_side(), turns)
+        batch = playouts / (time.time() - begin)
+        print(f'{board} {player}, turns: {turns}, _playout: {int(single)}/sec, playout_batch: {int(batch)}/sec, '
+              f'speedup: {round(batch / single, 2)}x')
+
+
+def _self_play_game(ais: List[AI], book_plies: int, max_turns: int,
+                    explore: float) -> Tuple[List[Tuple[int, int, Tuple[int, int]]], Union[int, None]]:
+    """
+    Plays a game between the AIs of each side. Returns the (hash, side, move) of the first book_plies moves and
+    the side that won, None for a draw after max_turns. Book moves are random with probability explore
+    """
+    position = Position.from_fen('RRRRRRRRR/9/9/9/9/9/9/9/BBBBBBBBB', "BLACK")
+    played = []
+    for turn in range(max_turns):
+        side = position.get_side()
+        if turn < book_plies and random.random() < explore:
+            move = random.choice(position.moves())
+        else:
+            from_location, to_location = ais[side].pick_move_fen(position.to_fen(), PLAYERS[side])
+            move = Position.to_square(from_location), Position.to_square(to_location)
+        if turn < book_plies:
+            played.append((position.get_hash(), side, move))
+        position.make(move)
+        if position.winner() is not None:
+            return played, position.winner()
+    return played, None
+
+
+def build_opening_book(path: str = "opening_book.bin", games: int = 100, book_plies: int = 8, max_turns: int = 60,
+                       node_limit: int = 2000, explore: float = 0.2, min_games: int = 2) -> None:
+    """
+    Plays games of the AI against itself and writes the opening book to path. Each position of the first
+    book_plies moves gets the move that scored best for the side that played it, out of the moves played in at
+    least min_games games
+    """
+    ais = [AI(None, None, player, time_limit=float('inf'), node_limit=node_limit, book=None) for player in PLAYERS]
+    # games and points of each move by the hash of the position it was played in
+    stats: Dict[int, Dict[Tuple[int, int], List[int]]] = {}
+    for game in range(games):
+        played, winning_side = _self_play_game(ais, book_plies, max_turns, explore)
+        for key, side, move in played:
+            move_stats = stats.setdefault(key, {}).setdefault(move, [0, 0])
+            move_stats[0] += 1
+            move_stats[1] += 1 if winning_side is None else 2 * (winning_side == side)
+        print(f'Game: {game + 1}, Winner: {"DRAW" if winning_side is None else PLAYERS[winning_side]}')
+    for ai in ais:
+        ai.close()
+
+    moves = {}
+    for key, move_stats in stats.items():
+        candidates = [(points / played, played, move) for move, (played, points) in move_stats.items()
+                      if played >= min_games]
+        if candidates:
+            _, played, move = max(candidates)
+            moves[key] = move, played, move_stats[move][1]
+    book = OpeningBook(path)
+    book.write(moves)
+    print(f'{book.get_count()} positions in the book')
+    book.close()
+
+
+def build_tablebase(path: str = "tablebase_2v2.bin") -> None:
+    """
+    Solves every position of 2 pieces against 2 by retrograde analysis and writes the Tablebase to path.
+    Any capture ends the game with 2 pieces each, so the positions only lead to each other or to the end.
+    Only one position of each set of symmetric positions is searched. Positions that win with their next move
+    or have only losing moves are solved first, then going backwards from each solved position with un-moves,
+    a position that can move to a loss is a win and one whose moves all lead to wins is a loss
+    """
+    size = PAIRS * PAIRS
+    representative = array('i', [-1]) * size            # the searched position of each set of symmetric ones
+    orbits = bytearray(size)                             # how many different positions are in the set
+    values = array('H', bytes(size * 2))
+    # moves of each searched position that aren't solved yet, times the size of its set, so that un-moves from
+    # the searched position of a solved set can be counted without finding the moves of the other positions
+    remaining = array('i', bytes(size * 4))
+    pairs = [(low, high) for high in range(81) for low in range(high)]
+
+    def symmetric(squares: List[int]) -> List[int]:
+        """returns the indexes of the position with own pieces on squares[:2] and others on squares[2:] turned"""
+        return [Tablebase.index(1 << table[squares[0]] | 1 << table[squares[1]],
+                                1 << table[squares[2]] | 1 << table[squares[3]]) for table in SYMMETRIES]
+
+    solved = []
+    searched = []
+    for own_index, own in enumerate(pairs):
+        for other_index, other in enumerate(pairs):
+            index = own_index * PAIRS + other_index
+            if representative[index] >= 0 or own[0] in other or own[1] in other:
+                continue
+            images = symmetric([*own, *other])
+            for image in images:
+                representative[image] = index
+            orbits[index] = len(set(images))
+            searched.append(index)
+
+    # first pass: the moves of every searched position, which are captures that end the game or quiet moves
+    for index in searched:
+        own_squares, other_squares = pairs[index // PAIRS], pairs[index % PAIRS]
+        own = 1 << own_squares[0] | 1 << own_squares[1]
+        other = 1 << other_squares[0] | 1 << other_squares[1]
+        occupied = own | other
+        quiet = 0
+        wins = False
+        for from_square in own_squares:
+            targets = Position.destinations(from_square, occupied)
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                to_square = target.bit_length() - 1
+                if ADJACENT[to_square] & other:          # a capture is only possible next to an other piece
+                    captured = Position.capture([own ^ 1 << from_square ^ target, other], 0, to_square)
+                    if captured[1]:                     # the other side is down to 1 piece
+                        wins = True
+                        break
+                    if captured[0]:                     # moved into a corner between 2 other pieces
+                        continue
+                quiet += 1
+            if wins:
+                break
+        if wins:
+            values[index] = 1 << 1 | 1
+            solved.append(index)
+        elif quiet == 0:
+            values[index] = 1 << 1
+            solved.append(index)
+        else:
+            remaining[index] = quiet * orbits[index]
+
+    # then go backwards from the solved positions in the order they were solved, so the plies are the shortest
+    # win and the longest loss
+    for index in solved:
+        value = values[index]
+        own_squares, other_squares = pairs[index // PAIRS], pairs[index % PAIRS]
+        own = 1 << own_squares[0] | 1 << own_squares[1]
+        other = 1 << other_squares[0] | 1 << other_squares[1]
+        occupied = own | other
+        for to_square in other_squares:                 # the other side made the last move
+            # the last move was quiet, so the moved piece can't capture anything where it is now
+            if ADJACENT[to_square] & own and any(Position.capture([other, own], 0, to_square)):
+                continue
+            sources = Position.destinations(to_square, occupied)
+            while sources:
+                source = sources & -sources
+                sources ^= source
+                previous = representative[Tablebase.index(other ^ 1 << to_square ^ source, own)]
+                if values[previous]:
+                    continue
+                if not value & 1:                       # moving here wins for the previous position
+                    values[previous] = (value >> 1) + 1 << 1 | 1
+                    solved.append(previous)
+                else:
+                    remaining[previous] -= orbits[index]
+                    if not remaining[previous]:         # every move of the previous position loses
+                        values[previous] = (value >> 1) + 1 << 1
+                        solved.append(previous)
+
+    for index in searched:
+        if values[index]:
+            own_squares, other_squares = pairs[index // PAIRS], pairs[index % PAIRS]
+            for image in symmetric([*own_squares, *other_squares]):
+                values[image] = values[index]
+    Tablebase.write(path, values)
+    print(f'{len(solved)} of {len(searched)} positions solved')
+
+
+def terminal(red_engine: str = "minimax", black_engine: str = "minimax"):
+    """
+    Plays AI against AI games without a window and prints each move and the times, each side uses the engine of
+    ENGINES named by red_engine and black_engine
+    """
     iterations = 1
     avg_times = []
     while iterations <= 15:
-        win = pg.display.set_mode((width, height))
-        game = HasamiShogiGame(win)
+        game = HasamiShogiGame()
         rank = "Xabcdefghi"
-        ai_red = AI(win, game, "RED")
-        ai_black = AI(win, game, "BLACK")
+        ai_red = ENGINES[red_engine](None, game, "RED")
+        ai_black = ENGINES[black_engine](None, game, "BLACK")
         turn = 0
         start = time.time()
         while game.get_game_state() == "UNFINISHED" and turn < 25:
@@ -1543,23 +3013,32 @@ def terminal():
             end = time.time()
             print(
                 f'Iteration: {iterations}, Turn: {turn}, Selection Time:{end - begin}, Total Time: {int((end - start) // 60)}:{(end - start) % 60}')
-        with open("red_moves.json", "w") as outfile:
-            json.dump(ai_red.get_mem_moves(), outfile, indent=3)
-
-        with open("black_moves.json", "w") as outfile:
-            json.dump(ai_black.get_mem_moves(), outfile, indent=3)
+        ai_red.save_mem_moves()
+        ai_black.save_mem_moves()
         print(game.get_game_state())
         avg_times.append((end - start) / turn)
         iterations += 1
     for avg_time in avg_times:
         print(round(avg_time, 4))
-    pg.quit()
 
 
 if __name__ == "__main__":
     # title_screen()
     # pg.quit()
 
-    terminal()
+    if len(sys.argv) > 2 and sys.argv[1] == "benchmark" and sys.argv[2] == "pruning":
+        benchmark(5, PRUNING_SETTINGS)
+    elif len(sys.argv) > 2 and sys.argv[1] == "benchmark" and sys.argv[2] == "playouts":
+        benchmark_playouts()
+    elif len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+    elif len(sys.argv) > 1 and sys.argv[1] == "book":
+        build_opening_book()
+    elif len(sys.argv) > 1 and sys.argv[1] == "tablebase":
+        build_tablebase()
+    elif len(sys.argv) > 1 and sys.argv[1] == "terminal":
+        terminal(*sys.argv[2:4])                        # engines of RED and BLACK, minimax by default
+    else:
+        terminal()
 
 